@@ -0,0 +1,293 @@
+import asyncio
+import io
+import json
+import random
+
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+
+class ImageServer:
+    """
+    A local stand-in for the Discord attachment CDN serving generated images.
+
+    Attributes:
+        count (int): The number of distinct images served.
+        size (int): The width and height of the images in pixels.
+        url (str): The base URL of the server once started.
+    """
+    def __init__(self, count: int, size: int):
+        self.count = count
+        self.size = size
+        self.url = ""
+        self._images = []
+        self._runner = None
+
+    def image_url(self, index: int) -> str:
+        """ Returns the URL of one of the served images. """
+        return f"{self.url}/attachments/{index % self.count}.png"
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        index = int(request.match_info["index"])
+        return web.Response(body=self._images[index], content_type="image/png")
+
+    async def start(self) -> None:
+        """ Generates the images and starts serving them on a free local port. """
+        for seed in range(self.count):
+            noise = np.random.RandomState(seed).rand(self.size // 16, self.size // 16, 3) * 255
+            img = Image.fromarray(noise.astype(np.uint8)).resize((self.size, self.size))
+            output = io.BytesIO()
+            img.save(output, "PNG")
+            self._images.append(output.getvalue())
+
+        app = web.Application()
+        app.router.add_get("/attachments/{index}.png", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self) -> None:
+        """ Stops the server. """
+        await self._runner.cleanup()
+
+class FakeGemini:
+    """
+    A local stand-in for the Gemini generate content endpoints, plain and streamed, with configurable latency and errors,
+    and the cached contents endpoints used to cache the prompt.
+
+    Attributes:
+        latency (float): Mean seconds before a response is returned.
+        error_rate (float): Fraction of requests answered with a 429 or 503.
+        retry_after (float): Seconds suggested in the RetryInfo of 429 responses.
+        requests (int): The number of requests received.
+        errors (int): The number of error responses returned.
+        url (str): The base URL of the server once started.
+        caches (set[str]): The names of the cached contents that exist.
+    """
+    PROMPT_TOKENS = 1000
+    IMAGE_TOKENS = 260
+
+    def __init__(self, latency: float, error_rate: float, retry_after: float = 0.05):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self.url = ""
+        self.caches = set()
+        self._runner = None
+
+    @staticmethod
+    def analysis() -> dict:
+        """ Returns a random analysis matching the response schema. """
+        score = random.randint(-100, 100)
+        return {
+            "analysis": "A benchmark analysis. " * 200,
+            "score": score,
+            "positives": [f"Factor {i}: Reasoning" for i in range(5)],
+            "negatives": [f"Factor {i}: Reasoning" for i in range(2)]
+        }
+
+    def _error(self) -> web.Response:
+        self.errors += 1
+        if random.random() < 0.5:
+            body = {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED", "details": [
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{self.retry_after}s"}
+            ]}}
+            return web.json_response(body, status=429)
+
+        body = {"error": {"code": 503, "message": "The model is overloaded", "status": "UNAVAILABLE"}}
+        return web.json_response(body, status=503)
+
+    def _usage(self, body: dict) -> dict:
+        prompt_tokens = self.PROMPT_TOKENS + self.IMAGE_TOKENS
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": 800, "totalTokenCount": prompt_tokens + 800}
+        if body.get("cachedContent") in self.caches:
+            usage["cachedContentTokenCount"] = self.PROMPT_TOKENS
+        return usage
+
+    def _cache_error(self, body: dict) -> web.Response | None:
+        if "cachedContent" in body and body["cachedContent"] not in self.caches:
+            body = {"error": {"code": 403, "message": "CachedContent not found", "status": "PERMISSION_DENIED"}}
+            return web.json_response(body, status=403)
+        return None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        if (response := self._cache_error(body)) is not None:
+            return response
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+        if random.random() < self.error_rate:
+            return self._error()
+
+        return web.json_response({
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": json.dumps(self.analysis())}]},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": self._usage(body)
+        })
+
+    async def _handle_stream(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        if (response := self._cache_error(body)) is not None:
+            return response
+        latency = random.uniform(0.5, 1.5) * self.latency
+        await asyncio.sleep(latency * 0.2) # Time to first token
+
+        if random.random() < self.error_rate:
+            return self._error()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        text = json.dumps(self.analysis())
+        chunk_count = 20
+        chunk_size = len(text) // chunk_count + 1
+        for i in range(0, len(text), chunk_size):
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text[i:i + chunk_size]}]}, "index": 0}]}
+            if i + chunk_size >= len(text):
+                chunk["candidates"][0]["finishReason"] = "STOP"
+                chunk["usageMetadata"] = self._usage(body)
+            await response.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+            await asyncio.sleep(latency * 0.8 / chunk_count)
+
+        await response.write_eof()
+        return response
+
+    def _cached_content(self, name: str) -> dict:
+        return {"name": name, "model": "models/fake", "usageMetadata": {"totalTokenCount": self.PROMPT_TOKENS}}
+
+    async def _handle_create_cache(self, request: web.Request) -> web.Response:
+        await request.read()
+        name = f"cachedContents/{len(self.caches) + 1}"
+        self.caches.add(name)
+        return web.json_response(self._cached_content(name))
+
+    async def _handle_update_cache(self, request: web.Request) -> web.Response:
+        await request.read()
+        name = f"cachedContents/{request.match_info['cache']}"
+        if name not in self.caches:
+            return web.json_response({"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}}, status=404)
+        return web.json_response(self._cached_content(name))
+
+    async def _handle_delete_cache(self, request: web.Request) -> web.Response:
+        self.caches.discard(f"cachedContents/{request.match_info['cache']}")
+        return web.json_response({})
+
+    async def start(self) -> None:
+        """ Starts the fake endpoint on a free local port. """
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/{version}/models/{model}:generateContent", self._handle)
+        app.router.add_post("/{version}/models/{model}:streamGenerateContent", self._handle_stream)
+        app.router.add_post("/{version}/cachedContents", self._handle_create_cache)
+        app.router.add_patch("/{version}/cachedContents/{cache}", self._handle_update_cache)
+        app.router.add_delete("/{version}/cachedContents/{cache}", self._handle_delete_cache)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self) -> None:
+        """ Stops the fake endpoint. """
+        await self._runner.cleanup()
+
+class FakeMember:
+    """ A guild member with the attributes the bot reads. """
+    def __init__(self, user_id: int, display_name: str):
+        self.id = user_id
+        self.display_name = display_name
+        self.name = display_name
+
+    def __str__(self) -> str:
+        return self.display_name
+
+class FakeGuild:
+    """
+    A guild whose member cache only holds part of its members, like a gateway cache without chunking.
+
+    Attributes:
+        id (int): The ID of the guild.
+        latency (float): Seconds a member request takes.
+    """
+    def __init__(self, guild_id: int, members: list[FakeMember], cached_fraction: float, latency: float):
+        self.id = guild_id
+        self.latency = latency
+        self._members = {member.id: member for member in members}
+        self._cache = {member.id: member for member in members if random.random() < cached_fraction}
+
+    def get_member(self, user_id: int) -> FakeMember | None:
+        return self._cache.get(user_id)
+
+    async def query_members(self, user_ids: list[int], limit: int, cache: bool) -> list[FakeMember]:
+        await asyncio.sleep(self.latency)
+        found = [self._members[user_id] for user_id in user_ids if user_id in self._members]
+        if cache:
+            self._cache.update({member.id: member for member in found})
+        return found[:limit]
+
+    async def fetch_member(self, user_id: int) -> FakeMember:
+        await asyncio.sleep(self.latency)
+        return self._members[user_id]
+
+class FakeInteraction:
+    """ The parts of an interaction used by command handlers and views. """
+    def __init__(self, context: "FakeContext"):
+        self.user = context.author
+        self.guild = context.guild
+        self.guild_id = context.guild_id
+        self.response = self
+        self._context = context
+
+    async def edit_message(self, **kwargs) -> None:
+        await self._context.edit(**kwargs)
+
+    async def send_message(self, content: str = None, **kwargs) -> None:
+        await self._context.send(content, **kwargs)
+
+class FakeContext:
+    """
+    A stand-in for discord.ApplicationContext that records every call and simulates API latency.
+
+    Attributes:
+        calls (list[tuple[str, str]]): The name of every API call made and the content sent with it.
+    """
+    def __init__(self, author: FakeMember, guild: FakeGuild, latency: float):
+        self.author = author
+        self.user = author
+        self.guild = guild
+        self.guild_id = guild.id
+        self.latency = latency
+        self.calls = []
+        self.interaction = FakeInteraction(self)
+
+    async def _call(self, name: str, content) -> None:
+        await asyncio.sleep(self.latency)
+        self.calls.append((name, content))
+
+    async def respond(self, content: str = None, **kwargs) -> None:
+        await self._call("respond", content)
+
+    async def edit(self, content: str = None, **kwargs) -> None:
+        await self._call("edit", content)
+
+    async def send(self, content: str = None, **kwargs) -> None:
+        await self._call("send", content)
+
+    async def defer(self, **kwargs) -> None:
+        await self._call("defer", None)
+
+class FakeAttachment:
+    """ An attachment pointing at the local image server. """
+    def __init__(self, url: str):
+        self.url = url
+        self.filename = url.rsplit("/", 1)[-1]
+        self.content_type = "image/png"
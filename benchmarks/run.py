@@ -0,0 +1,191 @@
+"""
+Benchmarks the analysis pipeline and command handlers against local stand-ins for Discord, Gemini, Redis and the image CDN.
+
+Usage (from the repository root):
+    python -m benchmarks.run --concurrency 16 --users 50 --operations 200 --output bench.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeAttachment, FakeContext, FakeGemini, FakeGuild, FakeMember, ImageServer
+
+
+SCENARIOS = ["image_analysis", "analyze_image", "analyze_images", "show_leaderboard", "show_score"]
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=8, help="Operations running at once")
+    parser.add_argument("--operations", type=int, default=100, help="Operations per scenario")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users issuing commands")
+    parser.add_argument("--images", type=int, default=20, help="Distinct images, fewer images means more cache hits")
+    parser.add_argument("--image-size", type=int, default=1024, help="Width and height of the served images")
+    parser.add_argument("--deep", action="store_true", help="Request deep analyses")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="Mean seconds per fake Gemini response")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Fraction of fake Gemini responses that are 429/503")
+    parser.add_argument("--gemini-rpm", type=int, default=100_000, help="Requests per minute allowed by the limiter")
+    parser.add_argument("--gemini-tpm", type=int, default=1_000_000_000, help="Tokens per minute allowed by the limiter")
+    parser.add_argument("--prompt-cache", action="store_true", help="Keep the prompt in the fake Gemini context cache")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="Seconds per fake Discord API call")
+    parser.add_argument("--cached-members", type=float, default=0.5, help="Fraction of members in the gateway cache")
+    parser.add_argument("--redis-url", help="Use this Redis server instead of an in-process fakeredis")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's own log output")
+    return parser.parse_args()
+
+def _latency_summary(latencies: list[float]) -> dict[str, float]:
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0.0, 0.0]
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50": round(percentiles[49] * 1000, 2),
+        "p95": round(percentiles[94] * 1000, 2),
+        "p99": round(percentiles[98] * 1000, 2),
+        "mean": round(statistics.fmean(latencies) * 1000, 2),
+        "max": round(max(latencies) * 1000, 2)
+    }
+
+async def _run_scenario(operation, count: int, concurrency: int) -> dict:
+    """ Runs an operation count times with the given concurrency and summarizes the latencies. """
+    latencies = []
+    errors = {}
+    remaining = iter(range(count))
+
+    async def worker():
+        for index in remaining:
+            start = time.perf_counter()
+            try:
+                await operation(index)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+
+    return {
+        "operations": count,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_per_s": round(len(latencies) / duration, 2),
+        "latency_ms": _latency_summary(latencies)
+    }
+
+async def main() -> None:
+    args = _parse_args()
+    random.seed(args.seed)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    images = ImageServer(args.images, args.image_size)
+    fake_gemini = FakeGemini(args.gemini_latency, args.gemini_error_rate)
+    await images.start()
+    await fake_gemini.start()
+
+    # The bot reads these when its modules are imported
+    os.environ["GEMINI_BASE_URL"] = fake_gemini.url
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+
+    analyzer = importlib.import_module("utils.analyzer")
+    database = importlib.import_module("utils.database")
+    gemini = importlib.import_module("utils.gemini")
+    image = importlib.import_module("utils.image")
+    metrics = importlib.import_module("utils.metrics")
+    ratelimit = importlib.import_module("utils.ratelimit")
+    render_cache = importlib.import_module("utils.render_cache")
+    analyze_cog = importlib.import_module("cogs.analyze").Analyze(None)
+    score_cog = importlib.import_module("cogs.score").Score(None)
+
+    if args.redis_url:
+        import redis.asyncio as redis
+        client = redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        import fakeredis
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    await database.connect(client)
+    await database.clear_database()
+
+    gemini.limiter = ratelimit.Limiter(args.gemini_rpm, args.gemini_tpm)
+    render_cache.start()
+    image.create_session()
+    if args.prompt_cache:
+        gemini.start()
+        while not gemini.prompt_cache_stats()["active"]:
+            await asyncio.sleep(0.01)
+
+    members = [FakeMember(1000 + i, f"User {i}") for i in range(args.users)]
+    guild = FakeGuild(1, members, args.cached_members, args.discord_latency)
+
+    def context() -> FakeContext:
+        return FakeContext(random.choice(members), guild, args.discord_latency)
+
+    async def image_analysis(index: int):
+        member = random.choice(members)
+        await analyzer.image_analysis(images.image_url(index), member.display_name, member.id, guild.id, deep=args.deep)
+
+    async def analyze_image(index: int):
+        await analyze_cog.image.callback(analyze_cog, context(), FakeAttachment(images.image_url(index)), args.deep)
+
+    async def analyze_images(index: int):
+        attachments = [FakeAttachment(images.image_url(index + i)) for i in range(3)]
+        await analyze_cog.images.callback(analyze_cog, context(), *attachments, None, args.deep)
+
+    async def show_leaderboard(index: int):
+        await score_cog.show_leaderboard.callback(score_cog, context(), random.choice(["all", "day", "week", "month"]))
+
+    async def show_score(index: int):
+        await score_cog.show_score.callback(score_cog, context(), random.choice(members))
+
+    operations = {
+        "image_analysis": image_analysis,
+        "analyze_image": analyze_image,
+        "analyze_images": analyze_images,
+        "show_leaderboard": show_leaderboard,
+        "show_score": show_score
+    }
+
+    results = {}
+    try:
+        for name in args.scenarios:
+            results[name] = await _run_scenario(operations[name], args.operations, args.concurrency)
+            summary = results[name]
+            print(
+                f"{name:<18} {summary['throughput_per_s']:>8.2f} ops/s  "
+                f"p50 {summary['latency_ms']['p50']:>9.2f} ms  p95 {summary['latency_ms']['p95']:>9.2f} ms  "
+                f"p99 {summary['latency_ms']['p99']:>9.2f} ms  errors {sum(summary['errors'].values())}"
+            )
+    finally:
+        await gemini.close()
+        await image.close_session()
+        await images.stop()
+        await fake_gemini.stop()
+
+    report = {
+        "config": vars(args),
+        "scenarios": results,
+        "gemini": {"requests": fake_gemini.requests, "errors": fake_gemini.errors, "limiter": gemini.limiter.stats(),
+                   "prompt_cache": gemini.prompt_cache_stats()},
+        "stages": [
+            {"stage": stage, "calls": calls, "mean_ms": round(mean * 1000, 3), "p95_ms": p95 * 1000}
+            for stage, calls, mean, p95 in metrics.summary()
+        ]
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,9 +1,10 @@
 import os
 import sys
+import time
 import discord
 from discord.ext import commands
 
-from utils import database, image
+from utils import database, image, cache, gemini, layout, metrics, reloader, render_cache, scheduler
 
 
 class Admin(commands.Cog):
@@ -19,6 +20,9 @@ class Admin(commands.Cog):
         """ Shuts down the bot. """
         await ctx.respond("Shutting down")
         await image.close_session()
+        await gemini.close()
+        render_cache.stop()
+        await database.close()
         await self.bot.close()
 
     @admin.command()
@@ -28,6 +32,25 @@ class Admin(commands.Cog):
         await ctx.respond(f"Restarting bot")
         os.execv(sys.executable, ['python'] + sys.argv)
 
+    @admin.command()
+    @commands.is_owner()
+    async def reload(self, ctx: discord.ApplicationContext):
+        """ Reloads changed cogs and utils without restarting the bot. """
+        start = time.perf_counter()
+        modules = reloader.reload_modules()
+        cogs = await reloader.reload_cogs(self.bot, reload_all=bool(modules))
+        elapsed = time.perf_counter() - start
+
+        await ctx.respond(f"Reloaded {len(modules)} modules and {len(cogs)} cogs in {elapsed * 1000:.0f} ms")
+
+    @admin.command()
+    @commands.is_owner()
+    async def stats(self, ctx: discord.ApplicationContext):
+        """ Shows performance metrics. """
+        await ctx.respond(layout.stats(
+            metrics.summary(), scheduler.running(), scheduler.queued(), metrics.loop_lag(), gemini.prompt_cache_stats()
+        ))
+
     @admin.command()
     @commands.is_owner()
     async def clear_scores(self, ctx: discord.ApplicationContext):
@@ -42,10 +65,25 @@ class Admin(commands.Cog):
         await database.clear_resources()
         await ctx.respond("Resources cleared")
 
+    @admin.command()
+    @commands.is_owner()
+    async def clear_analysis_cache(self, ctx: discord.ApplicationContext):
+        """ Clears all cached analyses. """
+        await cache.clear()
+        await ctx.respond("Analysis cache cleared")
+
+    @admin.command()
+    @commands.is_owner()
+    async def inspect_analysis_cache(self, ctx: discord.ApplicationContext):
+        """ Shows the size of the analysis cache. """
+        local_count, stored_count = await cache.stats()
+        await ctx.respond(f"Analysis cache: {local_count} in memory, {stored_count} in database")
+
     @admin.command()
     @commands.is_owner()
     async def clear_database(self, ctx: discord.ApplicationContext):
         """ Clears the database. """
+        await cache.clear()
         await database.clear_database()
         await ctx.respond("Database cleared")
         
@@ -1,7 +1,10 @@
 import discord
 from discord.ext import commands
 
-from utils import analyzer
+from config import SUPPORTED_IMAGE_TYPES, ANALYSIS_QUEUE
+from exceptions import UserInputError
+from utils import analyzer, jobs, layout, metrics
+from utils.messages import CoalescedEditor
 
 
 class Analyze(commands.Cog):
@@ -9,6 +12,39 @@ class Analyze(commands.Cog):
         self.bot = bot
 
     analyze = discord.SlashCommandGroup("analyze", "Analyze commands")
+
+    async def start_analysis(self, ctx: discord.ApplicationContext, image_urls: list[str], deep: bool = False, batch: bool = False):
+        """ Run an analysis, or hand it to a worker, and show its progress and result. """
+        with metrics.timed("discord.respond"):
+            await ctx.respond(layout.queue_position(0))
+
+        if ANALYSIS_QUEUE:
+            await jobs.enqueue(ctx.interaction, image_urls, ctx.author.display_name, ctx.author.id, ctx.guild_id, deep=deep, batch=batch)
+            return
+
+        async def edit(**fields):
+            with metrics.timed("discord.edit"):
+                await ctx.edit(**fields)
+
+        editor = CoalescedEditor(edit)
+
+        async def show_position(position: int):
+            editor.update(content=layout.queue_position(position))
+
+        async def show_preview(content: str):
+            editor.update(content=content)
+
+        messages = await analyzer.analyze(
+            image_urls, ctx.author.display_name, ctx.author.id, ctx.guild_id,
+            deep=deep, batch=batch, on_update=show_preview, on_position=show_position
+        )
+
+        editor.update(content=None, embeds=messages[0])
+        await editor.flush()
+
+        for embeds in messages[1:]:
+            with metrics.timed("discord.send"):
+                await ctx.send(embeds=embeds)
     
     @analyze.command()
     @discord.option(
@@ -24,11 +60,36 @@ class Analyze(commands.Cog):
     )
     async def image(self, ctx: discord.ApplicationContext, image: discord.Attachment, deep: bool):
         """ Analyze an image. """
-        await ctx.respond("🔄 Processing...")
-        messages = await analyzer.image_analysis(image.url, ctx.author.display_name, ctx.author.id, deep=deep)
+        await self.start_analysis(ctx, [image.url], deep)
+
+    @analyze.command()
+    @discord.option(name="image_1", description="The first image you want to analyze")
+    @discord.option(name="image_2", description="The second image you want to analyze", default=None)
+    @discord.option(name="image_3", description="The third image you want to analyze", default=None)
+    @discord.option(name="image_4", description="The fourth image you want to analyze", default=None)
+    @discord.option(
+        name="deep_analysis", 
+        parameter_name="deep",
+        description="Include deeper descriptions of the images",
+        default=False,
+    )
+    async def images(self, ctx: discord.ApplicationContext, image_1: discord.Attachment, image_2: discord.Attachment, 
+                     image_3: discord.Attachment, image_4: discord.Attachment, deep: bool):
+        """ Analyze several images at once. """
+        image_urls = [image.url for image in (image_1, image_2, image_3, image_4) if image is not None]
+        await self.start_analysis(ctx, image_urls, deep, batch=True)
+
+    @discord.message_command(name="Analyze all images")
+    async def analyze_message(self, ctx: discord.ApplicationContext, message: discord.Message):
+        """ Analyze all images in a message. """
+        image_urls = [attachment.url for attachment in message.attachments if attachment.content_type in SUPPORTED_IMAGE_TYPES]
+        for embed in message.embeds:
+            image_urls += [media.url for media in (embed.image, embed.thumbnail) if media and media.url]
+
+        if not image_urls:
+            raise UserInputError("This message does not contain any images")
 
-        for message in messages:
-            await ctx.send(message)
+        await self.start_analysis(ctx, image_urls, batch=True)
 
 def setup(bot):
-    bot.add_cog(Analyze(bot))
\ No newline at end of file
+    bot.add_cog(Analyze(bot))
@@ -1,12 +1,81 @@
 import discord
-import os
+import math
+from datetime import datetime, timezone
 from discord.ext import commands
-from dotenv import load_dotenv
 
-from utils import database, layout
+from config import LEADERBOARD_PAGE_SIZE, LEADERBOARD_TIMEOUT, LEADERBOARD_PERIODS
+from utils import database, layout, members, render_cache
 
 
-load_dotenv(override=True)
+class LeaderboardView(discord.ui.View):
+    """ Buttons for paging through the leaderboard. """
+    def __init__(self, period: str = "all"):
+        super().__init__(timeout=LEADERBOARD_TIMEOUT)
+        self.period = period
+        self.page = 0
+        self.pages = 1
+
+    def cache_key(self, *key) -> tuple:
+        """ Identifies a cached response of this leaderboard. Windows roll over at midnight UTC without a score update. """
+        return (*key, self.period, datetime.now(timezone.utc).date())
+
+    async def render_page(self, guild: discord.Guild, page: int) -> tuple[int, int, str]:
+        """ Reads and formats a page of the guild's leaderboard, clamping it to the available pages. """
+        page = max(page, 0)
+        scores, total = await database.get_leaderboard_page(page * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE, self.period, guild.id)
+        pages = max(1, math.ceil(total / LEADERBOARD_PAGE_SIZE))
+
+        if page >= pages:
+            page = pages - 1
+            scores, total = await database.get_leaderboard_page(page * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE, self.period, guild.id)
+
+        offset = page * LEADERBOARD_PAGE_SIZE
+        names = await members.resolve_names(guild, [user_id for user_id, _ in scores])
+        ranked_scores = [
+            (rank, names[user_id], score)
+            for rank, (user_id, score) in enumerate(scores, offset + 1)
+            if user_id in names
+        ]
+
+        return page, pages, layout.leaderboard(ranked_scores, page, pages, LEADERBOARD_PERIODS[self.period])
+
+    async def render(self, guild: discord.Guild) -> str:
+        """ Renders the current page, or reuses it if no score changed since it was last rendered. """
+        page = self.page
+        self.page, self.pages, content = await render_cache.get(
+            self.cache_key("leaderboard", guild.id, page), lambda: self.render_page(guild, page)
+        )
+
+        self.previous.disabled = self.page == 0
+        self.next.disabled = self.page == self.pages - 1
+
+        return content
+
+    async def show(self, interaction: discord.Interaction, page: int):
+        """ Switches to a page and edits the leaderboard message. """
+        self.page = page
+        content = await self.render(interaction.guild)
+        await interaction.response.edit_message(content=content, view=self)
+
+    @discord.ui.button(label="Previous", emoji="⬅️")
+    async def previous(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.show(interaction, self.page - 1)
+
+    @discord.ui.button(label="Next", emoji="➡️")
+    async def next(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.show(interaction, self.page + 1)
+
+    @discord.ui.button(label="My rank", emoji="🔎")
+    async def my_rank(self, button: discord.ui.Button, interaction: discord.Interaction):
+        rank = await render_cache.get(
+            self.cache_key("rank", interaction.guild_id, interaction.user.id),
+            lambda: database.get_rank(interaction.user.id, self.period, interaction.guild_id)
+        )
+        if rank is None:
+            await interaction.response.send_message(layout.error("You are not on the leaderboard"), ephemeral=True)
+            return
+
+        await self.show(interaction, rank // LEADERBOARD_PAGE_SIZE)
 
 class Score(commands.Cog):
     def __init__(self, bot):
@@ -14,21 +83,29 @@ class Score(commands.Cog):
 
     score = discord.SlashCommandGroup("score", "Score commands")
 
-    @discord.user_command(guild_ids=os.getenv("GUILD_IDS").split(","))
+    @discord.user_command()
     async def show_score(self, ctx: discord.ApplicationContext, member: discord.Member):
-        """ Show the W.R.U.F score of a member. """
-        score = await database.get_average_score(member.id)
-        await ctx.respond(layout.score(member.display_name, score))   
+        """ Show the W.R.U.F score of a member in this guild. """
+        async def render():
+            score, rank = await database.get_score_and_rank(member.id, ctx.guild_id)
+            return layout.score(member.display_name, score, rank)
+
+        content = await render_cache.get(("score", ctx.guild_id, member.id, member.display_name), render)
+        await ctx.respond(content)
 
     @score.command()
-    async def show_leaderboard(self, ctx: discord.ApplicationContext):
+    @discord.option(
+        name="period",
+        description="The time window to rank scores over",
+        choices=[discord.OptionChoice(title, period) for period, title in LEADERBOARD_PERIODS.items()],
+        default="all",
+    )
+    async def show_leaderboard(self, ctx: discord.ApplicationContext, period: str):
         """ Show the W.R.U.F leaderboard. """
-        guild = ctx.guild
-        
-        scores = await database.get_all_average_scores()
-        named_scores = [((await guild.fetch_member(user_id)).display_name, score) for user_id, score in scores]
+        view = LeaderboardView(period)
+        content = await view.render(ctx.guild)
 
-        await ctx.respond(layout.leaderboard(named_scores))
+        await ctx.respond(content, view=view)
 
 def setup(bot):
-    bot.add_cog(Score(bot))
\ No newline at end of file
+    bot.add_cog(Score(bot))
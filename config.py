@@ -1,6 +1,60 @@
 ICON_SET = ["✅", "❌", "🔄", "⚠️"]
+TRACE_SAMPLE_RATE = 1.0 # Fraction of commands that are traced
+TRACE_VERBOSITY = 1 # 0 disables tracing, 1 logs time spent per function, 2 also logs the full call tree
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108 # Port of the Prometheus endpoint
+LOOP_LAG_INTERVAL = 1.0 # Seconds between event loop lag measurements
+SHARD_IDENTIFY_CONCURRENCY = 1 # The bot's max_concurrency, IDENTIFYs Discord allows at once
+SHARD_IDENTIFY_INTERVAL = 5.0 # Seconds between IDENTIFYs of the same bucket, across all processes
 SUPPORTED_IMAGE_TYPES = ["image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"]
+IMAGE_MAX_BYTES = 25 * 1024 * 1024 # Downloads larger than this are aborted
+IMAGE_SPOOL_BYTES = 2 * 1024 * 1024 # Downloads larger than this are spilled to a temporary file
+IMAGE_CHUNK_BYTES = 64 * 1024
+IMAGE_MAX_SIDE = 1536 # Pixels, larger images are downscaled before they are sent to Gemini
+IMAGE_FORMAT = "WEBP"
+IMAGE_QUALITY = 85
 ALLOW_DUPLICATE = True
+MATCH_NEAR_DUPLICATES = False # Also reject recompressed or resized copies when duplicates are not allowed, at the cost of memes sharing a template
+DUPLICATE_DISTANCE = 4 # Maximum Hamming distance between perceptual hashes of near duplicates
+ANALYSIS_CACHE_SIZE = 256 # Entries kept in process
+ANALYSIS_CACHE_TTL = 60 * 60 * 24 * 7 # Seconds an entry is kept in the database
+ANALYSIS_CACHE_LOCAL_TTL = 60 * 5 # Seconds an entry is kept in process, so cleared or expired entries stop being served
+RENDER_CACHE_SIZE = 512 # Rendered leaderboard pages and scores kept in process
+RENDER_CACHE_TTL = 300 # Seconds a rendered response is kept, so changed display names show up
+RENDER_CACHE_RESYNC = 30.0 # Seconds between reads of the score version, in case a published change was missed
+DISPLAY_NAME_TTL = 60 * 60 # Seconds a resolved display name is kept in the database
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_TIMEOUT = 300 # Seconds the leaderboard buttons stay active
+LEADERBOARD_PERIODS = {"all": "All Time", "day": "Today", "week": "This Week", "month": "This Month"} # Windows are in UTC
+LEADERBOARD_WINDOW_RETENTION = 60 * 60 * 24 # Seconds a leaderboard window is kept after it ends
+SCORE_EVENTS_PER_USER = 1000 # Approximate number of score events kept per user
+MESSAGE_LIMIT = 2000 # Characters Discord allows in a message
+EMBED_DESCRIPTION_LIMIT = 4096 # Characters Discord allows in an embed description
+EMBED_MESSAGE_LIMIT = 6000 # Characters Discord allows across all embeds of a message
+EMBEDS_PER_MESSAGE = 10
+MESSAGE_EDIT_INTERVAL = 1.0 # Minimum seconds between edits of the same message
+MAX_CONCURRENT_ANALYSES = 4
+MAX_ANALYSES_PER_USER = 1 # Analyses a single user can have running at once, the rest wait in the queue
+MAX_QUEUED_ANALYSES = 50
+MAX_BATCH_IMAGES = 10 # Images a single batch analysis can contain
+ANALYSIS_QUEUE = False # Enqueue analyses for worker processes (worker.py) instead of running them in the bot
+INTERACTION_TOKEN_LIFETIME = 15 * 60 # Seconds Discord accepts responses to an interaction
+WORKER_METRICS_PORT = 9208 # Port of a worker's Prometheus endpoint, offset by WORKER_ID
+WORKER_POLL_TIMEOUT = 1.0 # Seconds a worker waits for new jobs in a single read
+WORKER_RECLAIM_INTERVAL = 15.0 # Seconds between a worker's checks for stalled jobs
+WORKER_CLAIM_IDLE = 60.0 # Seconds a job can go without a heartbeat before another worker reclaims it
+WORKER_MAX_DELIVERIES = 3 # Attempts at a job before it is given up
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+GEMINI_PROMPT_CACHE = True # Keep the prompt in a Gemini context cache instead of sending it with every request
+GEMINI_PROMPT_CACHE_TTL = 3600 # Seconds
+GEMINI_PROMPT_CACHE_RENEW = 300 # Seconds before expiry the cached prompt is renewed
+GEMINI_STREAM = True # Stream responses so results are shown while they are generated
+GEMINI_REQUESTS_PER_MINUTE = 10
+GEMINI_TOKENS_PER_MINUTE = 1_000_000
+GEMINI_ESTIMATED_TOKENS = 2000 # Tokens reserved per request until the real usage is known
+GEMINI_MAX_RETRIES = 5
+GEMINI_BACKOFF_BASE = 1.0 # Seconds
+GEMINI_BACKOFF_CAP = 30.0 # Seconds
 GEMINI_PROMPT = """
 You will be tasked with ranking internet memes and images on a brand new metric, the "W.R.U.F score". 
 You should score the image from on a scale from -100 to 100.
@@ -1,42 +1,135 @@
+import time
+started = time.perf_counter() # Taken before the other imports so they are part of the startup report
+
+import asyncio
 import discord
 import os
 from dotenv import load_dotenv
 
+from config import METRICS_PORT, SHARD_IDENTIFY_CONCURRENCY, SHARD_IDENTIFY_INTERVAL
 from exceptions import UserInputError
-from utils import system, layout, image
-
+from utils import system, layout, image, metrics, database, gemini, render_cache
 
-system.log(2, "Starting bot")
 
+# The environment is only loaded here, before anything reads it
 load_dotenv(override=True)
+system.record_startup_phase("imports", time.perf_counter() - started)
+
+system.log(2, "Starting bot")
 
 intents = discord.Intents.default()
 #intents.members = True
 #intents.message_content = True
 #intents.presences = True
 
-bot = discord.Bot(intents=intents)
+def parse_shard_ids(value: str) -> list[int]:
+    """
+    Parses shard IDs given as a range "0-3", a list "0,1,2" or a combination of both.
+
+    Args:
+        value (str): The shard IDs.
+
+    Returns:
+        list[int]: The shard IDs in order.
+    """
+    shard_ids = []
+    for part in value.split(","):
+        start, _, end = part.strip().partition("-")
+        shard_ids += range(int(start), int(end or start) + 1)
+
+    return shard_ids
+
+# SHARD_COUNT is "auto" for the recommended number of shards or the total number of shards across all processes, 
+# and SHARD_IDS is the shards this process runs, all of them if unset. Without SHARD_COUNT the bot is not sharded.
+shard_count = os.getenv("SHARD_COUNT")
+shard_ids = parse_shard_ids(os.getenv("SHARD_IDS")) if os.getenv("SHARD_IDS") else None
+
+if shard_ids is not None and not (shard_count or "").isdigit():
+    system.log(3, "SHARD_IDS requires SHARD_COUNT to be the total number of shards across all processes, not \"auto\" or unset")
+    raise SystemExit(1)
+
+if shard_count is None:
+    bot = discord.Bot(intents=intents)
+else:
+    bot = discord.AutoShardedBot(
+        intents=intents, 
+        shard_count=None if shard_count == "auto" else int(shard_count), 
+        shard_ids=shard_ids
+    )
+
+    async def stagger_identify(shard_id: int, *, initial: bool = False):
+        # Shards of every process take turns per rate limit bucket, so processes can start at the same time
+        await database.connect()
+        while not await database.claim_identify(shard_id % SHARD_IDENTIFY_CONCURRENCY, SHARD_IDENTIFY_INTERVAL):
+            await asyncio.sleep(0.5)
+
+    bot.before_identify_hook = stagger_identify
 
-for file in os.listdir("./cogs"):
-    name, ext = os.path.splitext(file) 
-    if ext == ".py":
-        bot.load_extension(f"cogs.{name}")
+    if shard_ids is not None:
+        gemini.share_quota(len(shard_ids) / int(shard_count))
+        system.log(2, f"Running shards {os.getenv('SHARD_IDS')} of {shard_count}")
 
-system.log_all_utils()
+with system.startup_phase("cogs"):
+    for file in os.listdir("./cogs"):
+        name, ext = os.path.splitext(file) 
+        if ext == ".py":
+            bot.load_extension(f"cogs.{name}")
+
+system.trace_all_utils()
+
+@bot.before_invoke
+async def start_trace(ctx: discord.ApplicationContext):
+    system.start_trace(ctx.command.qualified_name)
+
+@bot.after_invoke
+async def finish_trace(ctx: discord.ApplicationContext):
+    system.finish_trace(str(ctx.user))
+
+async def initialize():
+    """ Sets up the connections used by commands concurrently, while the gateway connects. """
+    async def timed(name, coro):
+        with system.startup_phase(name):
+            await coro
+
+    with system.startup_phase("http"):
+        image.create_session()
+    await asyncio.gather(timed("redis", database.connect()), timed("gemini", gemini.connect()))
+
+    metrics.start(METRICS_PORT + (shard_ids[0] if shard_ids else 0))
+    gemini.start()
+    render_cache.start()
+
+initialization: asyncio.Task | None = None
+gateway_started: float | None = None
 
 @bot.event
 async def on_ready():
-    image.create_session()
+    global gateway_started
+    await initialization
+
+    if gateway_started is not None:
+        system.record_startup_phase("gateway", time.perf_counter() - gateway_started)
+        system.log_startup(time.perf_counter() - started)
+        gateway_started = None
     
     system.log(0, f"{bot.user} is running")
 
+@bot.event
+async def on_shard_ready(shard_id: int):
+    system.log(0, f"Shard {shard_id} is ready")
+
 @bot.event
 async def on_application_command(ctx: discord.ApplicationContext):
+    metrics.COMMANDS_IN_FLIGHT.inc()
     system.log(2, f"{ctx.user} used command: {ctx.command.qualified_name}")
 
 @bot.event
 async def on_application_command_error(ctx: discord.ApplicationContext, error: discord.ApplicationCommandInvokeError):
-    original = error.original
+    original = getattr(error, "original", error)
+    if ctx.command is not None:
+        metrics.COMMANDS_IN_FLIGHT.dec()
+        metrics.COMMANDS.labels(ctx.command.qualified_name, "user_error" if isinstance(original, UserInputError) else "error").inc()
+
     if isinstance(original, UserInputError):
         await ctx.respond(layout.error("Invalid input", original))
         system.log(1, f"User input error: {original}")
@@ -44,10 +137,18 @@ async def on_application_command_error(ctx: discord.ApplicationContext, error: d
         await ctx.respond(layout.error("There was an unexpected error"))
         system.log(3, f"Unexpected error: {original}")
 
-    system.reset_dynamic_indent()
-
 @bot.event
 async def on_application_command_completion(ctx: discord.ApplicationContext):
+    metrics.COMMANDS_IN_FLIGHT.dec()
+    metrics.COMMANDS.labels(ctx.command.qualified_name, "success").inc()
+    metrics.COMMAND_SECONDS.labels(ctx.command.qualified_name).observe((discord.utils.utcnow() - ctx.interaction.created_at).total_seconds())
     system.log(0, f"{ctx.user} completed command: {ctx.command.qualified_name}")
 
-bot.run(os.getenv("BOT_TOKEN"))
+async def main():
+    global initialization, gateway_started
+    async with bot:
+        initialization = asyncio.create_task(initialize())
+        gateway_started = time.perf_counter()
+        await bot.start(os.getenv("BOT_TOKEN"))
+
+asyncio.run(main())
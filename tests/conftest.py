@@ -0,0 +1,26 @@
+import asyncio
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import database
+
+
+@pytest.fixture
+def run():
+    """ Runs a coroutine function on a new event loop, with the database connected to an in-memory Redis. """
+    def run(coroutine_function):
+        async def main():
+            await database.connect(fakeredis.FakeAsyncRedis(decode_responses=True))
+            try:
+                return await coroutine_function()
+            finally:
+                await database.close()
+
+        return asyncio.run(main())
+
+    return run
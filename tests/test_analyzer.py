@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import io
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config import MAX_CONCURRENT_ANALYSES, DUPLICATE_DISTANCE
+from utils import analyzer, image
+from utils.gemini import AnalysisSchema
+
+
+def slow_analyze(peak: list[int], running: list[int]):
+    """ Replaces the analysis of an image with a short sleep, recording how many run at once. """
+    async def analyze(image_url: str, deep: bool, on_update=None):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.1)
+        running[0] -= 1
+        return AnalysisSchema(score=50, positives=[], negatives=[], analysis=""), image_url, "0" * 16
+
+    return analyze
+
+def test_batch_images_overlap(run, monkeypatch):
+    peak, running = [0], [0]
+    monkeypatch.setattr(analyzer, "_analyze", slow_analyze(peak, running))
+    image_urls = [f"https://example.com/{i}.png" for i in range(4)]
+
+    run(lambda: analyzer.analyze(image_urls, "User", 1, batch=True))
+
+    assert peak[0] == min(len(image_urls), MAX_CONCURRENT_ANALYSES)
+
+def test_batch_is_not_held_up_by_the_next_analysis_of_its_user(run, monkeypatch):
+    peak, running = [0], [0]
+    monkeypatch.setattr(analyzer, "_analyze", slow_analyze(peak, running))
+
+    async def analyze_both():
+        # The single analysis queues for the user's slot before the batch queues its images
+        batch = asyncio.create_task(analyzer.analyze(["https://example.com/a.png", "https://example.com/b.png"], "User", 1, batch=True))
+        single = asyncio.create_task(analyzer.analyze(["https://example.com/c.png"], "User", 1))
+        await asyncio.wait_for(asyncio.gather(batch, single), 2)
+
+    run(analyze_both)
+
+def meme(caption: str) -> image.ImagePayload:
+    """ Draws a caption on the same meme template. """
+    img = Image.new("RGB", (480, 360), (70, 110, 160))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((140, 90, 340, 330), fill=(230, 190, 150))
+    draw.rectangle((0, 300, 480, 360), fill=(40, 40, 40))
+    draw.text((20, 10), caption, fill=(255, 255, 255), font=ImageFont.load_default(size=40))
+
+    file = io.BytesIO()
+    img.save(file, "PNG")
+    content = file.getvalue()
+
+    return image.ImagePayload(file, len(content), "image/png", hashlib.blake2b(content, digest_size=16).hexdigest(), 
+                              image.get_perceptual_hash(file))
+
+def test_captions_on_one_template_are_different_images(run, monkeypatch):
+    memes = {"first.png": meme("WHEN THE CODE WORKS"), "second.png": meme("ME ON MONDAY MORNING")}
+    first, second = memes.values()
+    assert (int(first.perceptual_hash, 16) ^ int(second.perceptual_hash, 16)).bit_count() <= DUPLICATE_DISTANCE
+
+    async def fetch(image_url: str):
+        return memes[image_url]
+
+    async def prepare(payload):
+        return payload
+
+    scores = iter([30, 80])
+    async def request(payload, on_partial=None):
+        return AnalysisSchema(score=next(scores), positives=[], negatives=[], analysis="")
+
+    monkeypatch.setattr(analyzer, "ALLOW_DUPLICATE", False)
+    monkeypatch.setattr(image, "fetch", fetch)
+    monkeypatch.setattr(image, "prepare", prepare)
+    monkeypatch.setattr(analyzer.gemini, "request", request)
+    monkeypatch.setattr(analyzer.cache, "_local", type(analyzer.cache._local)())
+
+    async def analyze_both():
+        return [await analyzer.image_analysis(image_url, "User", 1) for image_url in memes]
+
+    run(analyze_both)
+
+    assert next(scores, None) is None
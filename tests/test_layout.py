@@ -0,0 +1,22 @@
+import inspect
+
+from config import MESSAGE_LIMIT
+from utils import database, layout
+
+
+def test_stats_fits_in_a_message_with_every_stage():
+    redis_stages = [
+        f"redis.{name}" for name, func in vars(database).items()
+        if inspect.iscoroutinefunction(func) and hasattr(func, "__wrapped__")
+    ]
+    other_stages = [
+        "analysis.time_to_score", "discord.edit", "discord.respond", "discord.send", "gemini.request",
+        "gemini.wait_for_quota", "image.download", "image.perceptual_hash", "image.prepare"
+    ]
+    stages = [(name, 1000, 0.05, i / 100) for i, name in enumerate(redis_stages + other_stages)]
+
+    message = layout.stats(stages, 4, 12, 0.002, {"active": 1, "hits": 90, "misses": 10, "tokens_saved": 123456})
+
+    assert len(message) <= MESSAGE_LIMIT
+    assert stages[-1][0] in message
+    assert message.endswith("more stages")
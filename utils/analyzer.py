@@ -1,43 +1,185 @@
-from config import ALLOW_DUPLICATE
+import asyncio
+import functools
+import time
+from typing import Awaitable, Callable
+
+import discord
+
+from config import ALLOW_DUPLICATE, MATCH_NEAR_DUPLICATES, GEMINI_STREAM, MAX_BATCH_IMAGES
 from exceptions import UserInputError
-from utils import gemini, database, layout, image
+from utils import gemini, database, layout, image, cache, metrics, scheduler
+
+
+async def _analyze(image_url: str, deep: bool, on_update: Callable[[str], Awaitable[None]] | None = None) -> tuple[gemini.AnalysisSchema, str, str]:
+    """
+    Analyzes a single image using the Gemini service, or a cached result for the same image.
+
+    Args:
+        image_url (str): The URL of the image to analyze.
+        deep (bool): Whether the deep analysis should be shown in previews.
+        on_update (Callable[[str], Awaitable[None]], optional): Called with a preview of the result while it is 
+            being generated, if streaming is enabled. Defaults to None.
+
+    Returns:
+        tuple[gemini.AnalysisSchema, str, str]: The analysis, and the hash and perceptual hash of the image.
+
+    Raises:
+        UserInputError: If the fetched content type is not supported or if the image has already been analyzed.
+    """
+    start = time.perf_counter()
+
+    with await image.fetch(image_url) as payload:
+        if not ALLOW_DUPLICATE:
+            perceptual_hash = payload.perceptual_hash if MATCH_NEAR_DUPLICATES else None
+            if await database.find_resource(payload.hash, perceptual_hash) is not None:
+                raise UserInputError("This image has already been analyzed before")
+
+        response = await cache.get(payload.hash)
+        if response is None:
+            on_partial = None
+            if on_update is not None and GEMINI_STREAM:
+                score_shown = False
+
+                async def on_partial(fields: dict):
+                    nonlocal score_shown
+                    if not score_shown and "score" in fields:
+                        metrics.STAGE_SECONDS.labels("analysis.time_to_score").observe(time.perf_counter() - start)
+                        score_shown = True
 
+                    await on_update(layout.partial_result(
+                        fields.get("score"), fields.get("positives"), fields.get("negatives"), 
+                        fields.get("analysis") if deep else None
+                    ))
 
-async def image_analysis(image_url: str, author_name: str, author_id: int, deep: bool = False) -> list[str]:
+            response = await gemini.request(await image.prepare(payload), on_partial)
+            await cache.put(payload.hash, response)
+
+    return response, payload.hash, payload.perceptual_hash
+
+async def image_analysis(image_url: str, author_name: str, author_id: int, guild_id: int | None = None, deep: bool = False, 
+                         on_update: Callable[[str], Awaitable[None]] | None = None) -> list[list[discord.Embed]]:
     """
-    Analyzes an image using the Gemini service and updates the author's score in the database.
+    Analyzes an image using the Gemini service, or a cached result for the same image, and updates the author's score in the database.
 
     Args:
         image_url (str): The URL of the image to analyze.
         author_name (str): The name of the author requesting the analysis.
         author_id (int): The unique identifier of the author.
+        guild_id (int | None, optional): The ID of the guild the score is earned in, None outside of a guild. Defaults to None.
         deep (bool, optional): Whether to include a deep analysis in the response. Defaults to False.
+        on_update (Callable[[str], Awaitable[None]], optional): Called with a preview of the result while it is 
+            being generated, if streaming is enabled. Defaults to None.
 
     Returns:
-        list[str]: A list of messages containing the analysis results and score updates.
+        list[list[discord.Embed]]: The embeds of each message showing the analysis result and score update.
 
     Raises:
         UserInputError: If the fetched content type is not supported or if the image has already been analyzed.
     """
-    messages = []
-
-    image_hash = await image.get_hash(image_url)
+    response, image_hash, perceptual_hash = await _analyze(image_url, deep, on_update)
 
-    if not ALLOW_DUPLICATE and await database.check_resource(image_hash):
+    # Claiming the image before scoring it keeps concurrent analyses of the same image from all scoring
+    if not await database.add_resource(image_hash, perceptual_hash) and not ALLOW_DUPLICATE:
         raise UserInputError("This image has already been analyzed before")
 
-    response = await gemini.request(image_url)
-
-    old_average = await database.get_average_score(author_id)
-    await database.update_score(author_id, response.score)
-    new_average = await database.get_average_score(author_id)
-    
-    messages.append(image_url)
-    messages.append(layout.result(response.score, response.positives, response.negatives))
-    if deep:
-        messages.append(response.analysis)
-    messages.append(layout.score_update(author_name, old_average, new_average))
-
-    await database.add_resource(image_hash)
-    
-    return messages
+    old_average, new_average = await database.update_score(author_id, response.score, guild_id)
+
+    return layout.result(
+        image_url, response.score, response.positives, response.negatives,
+        layout.score_update(author_name, old_average, new_average),
+        response.analysis if deep else None
+    )
+
+async def batch_analysis(image_urls: list[str], author_name: str, author_id: int, guild_id: int | None = None, 
+                         deep: bool = False, on_position: Callable[[int], Awaitable[None]] | None = None) -> list[list[discord.Embed]]:
+    """
+    Analyzes several images concurrently and updates the author's score once with their combined score. 
+    The batch takes one of the author's scheduler slots and every image takes a global one, so a batch 
+    is held to the same concurrency limits as single analyses. Images that cannot be analyzed because 
+    of invalid input are skipped.
+
+    Args:
+        image_urls (list[str]): The URLs of the images to analyze.
+        author_name (str): The name of the author requesting the analysis.
+        author_id (int): The unique identifier of the author.
+        guild_id (int | None, optional): The ID of the guild the score is earned in, None outside of a guild. Defaults to None.
+        deep (bool, optional): Whether to include deep analyses in the response. Defaults to False.
+        on_position (Callable[[int], Awaitable[None]], optional): Called with the queue position of the batch, 
+            then of its first image, whenever it changes. Defaults to None.
+
+    Returns:
+        list[list[discord.Embed]]: The embeds of each message showing the analysis results and score update.
+
+    Raises:
+        UserInputError: If there are too many images or none of the images could be analyzed.
+    """
+    if len(image_urls) > MAX_BATCH_IMAGES:
+        raise UserInputError(f"At most {MAX_BATCH_IMAGES} images can be analyzed at once")
+
+    async def analyze_images():
+        return await asyncio.gather(*[
+            scheduler.run(author_id, functools.partial(_analyze, image_url, deep), on_position if i == 0 else None, per_user=False)
+            for i, image_url in enumerate(image_urls)
+        ], return_exceptions=True)
+
+    results = await scheduler.run(author_id, analyze_images, on_position, concurrent=False)
+
+    analyzed = []
+    skipped = []
+    for i, (image_url, result) in enumerate(zip(image_urls, results), 1):
+        if isinstance(result, UserInputError):
+            skipped.append(f"Image {i}: {result}")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            analyzed.append((i, image_url, *result))
+
+    claimed = await asyncio.gather(*[database.add_resource(image_hash, perceptual_hash) for *_, image_hash, perceptual_hash in analyzed])
+    if not ALLOW_DUPLICATE:
+        skipped += [f"Image {i}: This image has already been analyzed before" for (i, *_), added in zip(analyzed, claimed) if not added]
+        analyzed = [result for result, added in zip(analyzed, claimed) if added]
+
+    if not analyzed:
+        raise UserInputError("None of the images could be analyzed\n" + "\n".join(skipped))
+
+    score = round(sum(response.score for _, _, response, _, _ in analyzed) / len(analyzed))
+    old_average, new_average = await database.update_score(author_id, score, guild_id)
+
+    return layout.batch_result(
+        [(image_url, response.score, response.positives, response.negatives, response.analysis if deep else None)
+         for _, image_url, response, _, _ in analyzed],
+        score, layout.score_update(author_name, old_average, new_average), skipped
+    )
+
+async def analyze(image_urls: list[str], author_name: str, author_id: int, guild_id: int | None = None, deep: bool = False, 
+                  batch: bool = False, on_update: Callable[[str], Awaitable[None]] | None = None, 
+                  on_position: Callable[[int], Awaitable[None]] | None = None) -> list[list[discord.Embed]]:
+    """
+    Runs a single image or batch analysis, as requested by a command, once the scheduler allows it.
+
+    Args:
+        image_urls (list[str]): The URLs of the images to analyze, a single one unless batch is set.
+        author_name (str): The name of the author requesting the analysis.
+        author_id (int): The unique identifier of the author.
+        guild_id (int | None, optional): The ID of the guild the score is earned in, None outside of a guild. Defaults to None.
+        deep (bool, optional): Whether to include deep analyses in the response. Defaults to False.
+        batch (bool, optional): Whether to analyze the images as a batch. Defaults to False.
+        on_update (Callable[[str], Awaitable[None]], optional): Called with a preview of a single image result 
+            while it is being generated. Defaults to None.
+        on_position (Callable[[int], Awaitable[None]], optional): Called with the queue position whenever it changes, 
+            and with 0 once the analysis starts. Defaults to None.
+
+    Returns:
+        list[list[discord.Embed]]: The embeds of each message showing the analysis results and score update.
+
+    Raises:
+        UserInputError: If the queue is full or the images could not be analyzed.
+    """
+    if batch:
+        return await batch_analysis(image_urls, author_name, author_id, guild_id, deep=deep, on_position=on_position)
+
+    return await scheduler.run(
+        author_id,
+        lambda: image_analysis(image_urls[0], author_name, author_id, guild_id, deep=deep, on_update=on_update),
+        on_position
+    )
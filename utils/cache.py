@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+
+from config import ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_LOCAL_TTL
+from utils import database
+from utils.gemini import AnalysisSchema
+
+
+_local: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+def _remember(image_hash: str, serialized: str) -> None:
+    """
+    Stores a serialized analysis in the in-process cache for ANALYSIS_CACHE_LOCAL_TTL seconds, 
+    evicting the least recently used entry if full.
+
+    Args:
+        image_hash (str): The hash of the analyzed image.
+        serialized (str): The analysis serialized as JSON.
+    """
+    _local[image_hash] = (time.monotonic() + min(ANALYSIS_CACHE_LOCAL_TTL, ANALYSIS_CACHE_TTL), serialized)
+    _local.move_to_end(image_hash)
+
+    while len(_local) > ANALYSIS_CACHE_SIZE:
+        _local.popitem(last=False)
+
+async def get(image_hash: str) -> AnalysisSchema | None:
+    """
+    Looks up a previous analysis of an image, first in process and then in the database. 
+    Expired in-process entries are dropped.
+
+    Args:
+        image_hash (str): The hash of the image.
+
+    Returns:
+        AnalysisSchema | None: The cached analysis, or None if the image has not been analyzed.
+    """
+    expires_at, serialized = _local.get(image_hash, (0.0, None))
+    if serialized is not None and expires_at <= time.monotonic():
+        del _local[image_hash]
+        serialized = None
+
+    if serialized is not None:
+        _local.move_to_end(image_hash)
+    else:
+        serialized = await database.get_cached_analysis(image_hash)
+        if serialized is None:
+            return None
+        _remember(image_hash, serialized)
+
+    return AnalysisSchema.model_validate_json(serialized)
+
+async def put(image_hash: str, analysis: AnalysisSchema) -> None:
+    """
+    Stores the analysis of an image in both cache tiers.
+
+    Args:
+        image_hash (str): The hash of the image.
+        analysis (AnalysisSchema): The analysis to store.
+    """
+    serialized = analysis.model_dump_json()
+
+    _remember(image_hash, serialized)
+    await database.cache_analysis(image_hash, serialized, ANALYSIS_CACHE_TTL)
+
+async def clear() -> None:
+    """
+    Clears both cache tiers.
+    """
+    _local.clear()
+    await database.clear_analysis_cache()
+
+async def stats() -> tuple[int, int]:
+    """
+    Retrieves the number of cached analyses in each tier.
+
+    Returns:
+        tuple[int, int]: The number of entries held in process and in the database.
+    """
+    return len(_local), await database.count_cached_analyses()
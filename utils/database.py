@@ -1,161 +1,617 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
 import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError, ResponseError
+
+from config import DUPLICATE_DISTANCE, LEADERBOARD_WINDOW_RETENTION, SCORE_EVENTS_PER_USER
+from utils import metrics
 
 
 # Setup
 
-r = redis.Redis(host='redis-database', port=6379, decode_responses=True)
+r: redis.Redis | None = None
+_connecting: asyncio.Task | None = None
+
+async def connect(client: redis.Redis | None = None) -> None:
+    """
+    Connect to Redis if not already connected, sharing one attempt between concurrent callers. 
+    Configured from the environment:
+        - REDIS_URL: The server URL, redis:// or unix://. Defaults to the redis-database container.
+        - REDIS_SOCKET: The path of a unix socket to use instead of REDIS_URL.
+        - REDIS_POOL_SIZE: The maximum number of pooled connections. Defaults to 20.
+        - REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT: Seconds before a command or connection attempt fails. Default to 5.
+        - REDIS_HEALTH_CHECK_INTERVAL: Seconds a connection can be idle before it is checked. Defaults to 30.
+        - REDIS_RETRIES: Retries of a command after a connection error. Defaults to 3.
+
+    Args:
+        client (redis.Redis | None, optional): An existing client to use instead, e.g. for benchmarks. Defaults to None.
+    """
+    global _connecting
+    if r is not None:
+        return
+
+    if _connecting is None:
+        _connecting = asyncio.create_task(_connect(client))
+    try:
+        await asyncio.shield(_connecting)
+    except Exception:
+        _connecting = None
+        raise
+
+async def _connect(client: redis.Redis | None) -> None:
+    """
+    Create the Redis client, check the connection and register the Lua scripts.
+
+    Args:
+        client (redis.Redis | None): An existing client to use instead of creating one.
+    """
+    global r, _update_score_script
+    if client is None:
+        socket = os.getenv("REDIS_SOCKET")
+        url = f"unix://{socket}" if socket else os.getenv("REDIS_URL", "redis://redis-database:6379/0")
+        pool = redis.BlockingConnectionPool.from_url(
+            url,
+            decode_responses=True,
+            max_connections=int(os.getenv("REDIS_POOL_SIZE", "20")),
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+            socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "5")),
+            health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+            retry=Retry(ExponentialBackoff(), int(os.getenv("REDIS_RETRIES", "3"))),
+            retry_on_error=[ConnectionError, TimeoutError]
+        )
+        client = redis.Redis(connection_pool=pool)
+
+    await client.ping()
+    _update_score_script = client.register_script(_UPDATE_SCORE_LUA)
+    r = client
+
+async def close() -> None:
+    """
+    Close the Redis client and its connection pool.
+    """
+    global r, _connecting
+    if r is not None:
+        await r.aclose(close_connection_pool=True)
+        r = None
+        _connecting = None
+
+def batch() -> redis.client.Pipeline:
+    """
+    Start a pipeline that sends all queued commands in a single round trip when executed.
+
+    Returns:
+        redis.client.Pipeline: A non-transactional pipeline, to be used as an async context manager.
+    """
+    return r.pipeline(transaction=False)
 
 
 # Score Management
 
-async def _get_score_sum(user_id: str) -> int:
+# Every score update is appended to the user's event log, with the guild and windows it counted towards so the 
+# totals can be rebuilt from it, and added to the all-time totals and to the totals of 
+# the current day, week and month window, both globally and for the guild it was earned in. Window keys expire 
+# after their window ends, so no job has to clear them. The score version is bumped and published with every 
+# update, so processes caching rendered scores know to drop them. The averages returned are those of the 
+# first key triplet, the all-time set of the guild or the global one outside of a guild.
+_UPDATE_SCORE_LUA = """
+local function add_score(sums, counts, averages)
+    local score = redis.call('HINCRBY', sums, ARGV[1], ARGV[2])
+    local count = redis.call('HINCRBY', counts, ARGV[1], 1)
+    local scaled_average = (score / count) * (1 + (count / 100))
+    redis.call('ZADD', averages, scaled_average, ARGV[1])
+end
+
+local old_average = redis.call('ZSCORE', KEYS[5], ARGV[1]) or '0'
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', 'score', ARGV[2], 'guild', ARGV[5], 'windows', ARGV[6])
+
+for i = 3, #KEYS, 3 do
+    add_score(KEYS[i], KEYS[i + 1], KEYS[i + 2])
+    local expire_at = tonumber(ARGV[7 + (i - 3) / 3])
+    if expire_at > 0 then
+        for j = i, i + 2 do
+            redis.call('EXPIREAT', KEYS[j], expire_at)
+        end
+    end
+end
+
+redis.call('PUBLISH', ARGV[4], redis.call('INCR', KEYS[2]))
+
+return {old_average, redis.call('ZSCORE', KEYS[5], ARGV[1])}
+"""
+_WINDOWS = ("day", "week", "month")
+_SCORE_VERSION = "score_version"
+_SCORE_VERSION_CHANNEL = "score_version"
+
+def _window(period: str, now: datetime) -> tuple[str, int]:
     """
-    Retrieve the score sum for a specific user.
+    Get the window of a leaderboard period that contains a point in time.
 
     Args:
-        user_id (str): The ID of the user whose score is to be retrieved.
+        period (str): The period, "day", "week" or "month".
+        now (datetime): The point in time, in UTC.
 
     Returns:
-        int: The score sum of the user. Returns 0 if the user has no score.
-    """    
-    score = await r.hget("score_sums", user_id)
+        tuple[str, int]: The name of the window, e.g. "2025-W07", and the Unix time at which it ends.
+    """
+    today = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    if period == "day":
+        return today.strftime("%Y-%m-%d"), int((today + timedelta(days=1)).timestamp())
+    if period == "week":
+        year, week, weekday = today.isocalendar()
+        return f"{year}-W{week:02d}", int((today + timedelta(days=8 - weekday)).timestamp())
 
-    return int(score) if score is not None else 0
+    next_month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return today.strftime("%Y-%m"), int(next_month.timestamp())
 
-async def _set_score_sum(user_id: str, score: int) -> None:
+def _scope(period: str, guild_id: int | None, now: datetime) -> str:
     """
-    Set the score sum for a specific user.
+    Get the key suffix of the score totals of a leaderboard period and guild.
 
     Args:
-        user_id (str): The ID of the user whose score is to be set.
-        score (int): The score sum to set for the user.
+        period (str): The period, "all" or the "day", "week" or "month" containing now.
+        guild_id (int | None): The ID of the guild, None for the global totals.
+        now (datetime): The point in time, in UTC.
+
+    Returns:
+        str: The suffix to append to "score_sums", "analysis_counts" or "average_scores", e.g. ":guild:42:day:2025-02-14".
     """
-    await r.hset("score_sums", user_id, score)
+    suffix = f":guild:{guild_id}" if guild_id is not None else ""
+    if period != "all":
+        window, _ = _window(period, now)
+        suffix += f":{period}:{window}"
+
+    return suffix
 
-async def _get_analysis_count(user_id: str) -> int:
+def _average_key(period: str, guild_id: int | None = None) -> str:
     """
-    Retrieve the analysis count for a specific user.
+    Get the key of the sorted set holding the average scores of a leaderboard period.
 
     Args:
-        user_id (str): The ID of the user whose count is to be retrieved.
+        period (str): The period, "all" or the current "day", "week" or "month".
+        guild_id (int | None, optional): The ID of the guild, None for the global leaderboard. Defaults to None.
 
     Returns:
-        int: The analysis count of the user. Returns 0 if the user has no count.
+        str: The key of the sorted set.
     """
-    count = await r.hget("analysis_counts", user_id)
-    
-    return int(count) if count is not None else 0
+    return "average_scores" + _scope(period, guild_id, datetime.now(timezone.utc))
 
-async def _set_analysis_count(user_id: str, count: int) -> None:
+_update_score_script = None
+
+@metrics.timed_stage("redis")
+async def get_score_and_rank(user_id: str, guild_id: int | None = None) -> tuple[float, int | None]:
     """
-    Set the analysis count for a specific user.
+    Retrieve the average score and leaderboard position of a specific user in a single round trip.
 
     Args:
-        user_id (str): The ID of the user whose analysis count is to be set.
-        count (int): The analysis count to set for the user.
+        user_id (str): The ID of the user whose score and rank are to be retrieved.
+        guild_id (int | None, optional): The ID of the guild, None for the global leaderboard. Defaults to None.
+
+    Returns:
+        tuple[float, int | None]: The average score of the user, 0.0 if they have no scores, and their 
+            zero-based position, None if they are not on the leaderboard.
     """
-    await r.hset("analysis_counts", user_id, count)
+    key = _average_key("all", guild_id)
+    async with batch() as pipe:
+        pipe.zscore(key, user_id)
+        pipe.zrevrank(key, user_id)
+        average, rank = await pipe.execute()
+
+    return average if average is not None else 0.0, rank
 
-async def get_average_score(user_id: str) -> float:
+@metrics.timed_stage("redis")
+async def get_leaderboard_page(offset: int, limit: int, period: str = "all",
+                               guild_id: int | None = None) -> tuple[list[tuple[str, float]], int]:
     """
-    Retrieve the average score for a specific user from a sorted set.
+    Retrieve a page of average scores, highest first, together with the number of users on the leaderboard
+    in a single round trip.
 
     Args:
-        user_id (str): The ID of the user whose average score is to be retrieved.
+        offset (int): The number of entries to skip.
+        limit (int): The maximum number of entries to retrieve.
+        period (str, optional): The leaderboard period, "all" or the current "day", "week" or "month". Defaults to "all".
+        guild_id (int | None, optional): The ID of the guild, None for the global leaderboard. Defaults to None.
 
     Returns:
-        float: The average score of the user. Returns 0.0 if the user has no scores.
+        tuple[list[tuple[str, float]], int]: The user IDs and average scores on the page, and the total number of users.
     """
-    average = await r.zscore("average_scores" , user_id)
-    
-    return average if average is not None else 0.0
+    key = _average_key(period, guild_id)
+    async with batch() as pipe:
+        pipe.zrevrange(key, offset, offset + limit - 1, withscores=True)
+        pipe.zcard(key)
+        scores, total = await pipe.execute()
 
-async def _set_average_score(user_id: str) -> None:
+    return [(user_id, score) for user_id, score in scores], total
+
+@metrics.timed_stage("redis")
+async def get_rank(user_id: str, period: str = "all", guild_id: int | None = None) -> int | None:
     """
-    Set the average score for a specific user.
+    Retrieve the zero-based leaderboard position of a specific user.
 
     Args:
-        user_id (str): The ID of the user whose average score is to be set.
-        average (float): The average score to set for the user.
+        user_id (str): The ID of the user whose rank is to be retrieved.
+        period (str, optional): The leaderboard period, "all" or the current "day", "week" or "month". Defaults to "all".
+        guild_id (int | None, optional): The ID of the guild, None for the global leaderboard. Defaults to None.
+
+    Returns:
+        int | None: The position of the user, highest score first. Returns None if the user has no score.
+    """
+    return await r.zrevrank(_average_key(period, guild_id), user_id)
+
+@metrics.timed_stage("redis")
+async def update_score(user_id: str, earned: int, guild_id: int | None = None) -> tuple[float, float]:
+    """
+    Atomically add the earned points to a user's score sum, increment their analysis count and
+    recalculate their scaled average, all in a single round trip. The same is done for the current 
+    day, week and month window and for the guild the points were earned in, and the points are 
+    appended to the user's score event log together with the guild and windows they counted towards.
+
+    Args:
+        user_id (str): The ID of the user whose score is to be updated.
+        earned (int): The points to add to the user's score.
+        guild_id (int | None, optional): The ID of the guild the points were earned in, None outside of a guild. Defaults to None.
+
+    Returns:
+        tuple[float, float]: The user's all-time average score before and after the update, in the guild 
+            if one is given and globally otherwise.
+    """
+    now = datetime.now(timezone.utc)
+    keys = [f"score_events:{user_id}", _SCORE_VERSION]
+    expire_at = []
+    for scope_guild_id in ([None] if guild_id is None else [guild_id, None]):
+        for period in ("all", *_WINDOWS):
+            suffix = _scope(period, scope_guild_id, now)
+            keys += [f"score_sums{suffix}", f"analysis_counts{suffix}", f"average_scores{suffix}"]
+            expire_at.append(0 if period == "all" else _window(period, now)[1] + LEADERBOARD_WINDOW_RETENTION)
+
+    windows = " ".join(f"{period}:{_window(period, now)[0]}" for period in _WINDOWS)
+    old_average, new_average = await _update_score_script(
+        keys=keys, 
+        args=[user_id, earned, SCORE_EVENTS_PER_USER, _SCORE_VERSION_CHANNEL, guild_id or "", windows, *expire_at]
+    )
+
+    return float(old_average), float(new_average)
+
+@metrics.timed_stage("redis")
+async def get_score_version() -> int:
     """
-    score = await _get_score_sum(user_id)
-    count = await _get_analysis_count(user_id)
-    scaled_average = (score / count) * (1 + (count / 100))
+    Retrieve the score version, which changes whenever any score changes.
 
-    await r.zadd("average_scores", {user_id: scaled_average})
+    Returns:
+        int: The current score version.
+    """
+    return int(await r.get(_SCORE_VERSION) or 0)
 
-async def get_all_average_scores() -> list[tuple[str, float]]:
+async def subscribe_score_version() -> redis.client.PubSub:
     """
-    Retrieve all average scores from the database.
+    Subscribe to the score versions published whenever any score changes.
 
     Returns:
-        list[tuple[str, float]]: A list of tuples containing user IDs and their average scores.
+        redis.client.PubSub: The subscription, whose messages hold the new version. To be used as an async context manager.
     """
-    scores = await r.zrevrange("average_scores", 0, -1, withscores=True)
+    pubsub = r.pubsub()
+    await pubsub.subscribe(_SCORE_VERSION_CHANNEL)
 
-    return [(user_id, score) for user_id, score in scores]
+    return pubsub
 
-async def update_score(user_id: str, earned: int) -> None:
+
+# Display Names
+
+@metrics.timed_stage("redis")
+async def get_display_names(guild_id: int, user_ids: list[str]) -> dict[str, str]:
     """
-    Update the score for a specific user by adding the earned points.
+    Retrieve the cached display names of users in a guild.
 
     Args:
-        user_id (str): The ID of the user whose score is to be updated.
-        earned (int): The points to add to the user's score.
+        guild_id (int): The ID of the guild the names belong to.
+        user_ids (list[str]): The IDs of the users whose names are to be retrieved.
+
+    Returns:
+        dict[str, str]: A mapping of user IDs to display names for the users that are cached.
     """
-    old_score = await _get_score_sum(user_id)
-    new_score = old_score + earned
-    await _set_score_sum(user_id, new_score)
+    names = await r.hmget(f"display_names:{guild_id}", user_ids)
 
-    old_count = await _get_analysis_count(user_id)
-    new_count = old_count + 1
-    await _set_analysis_count(user_id, new_count)
+    return {user_id: name for user_id, name in zip(user_ids, names) if name is not None}
 
-    await _set_average_score(user_id)
+@metrics.timed_stage("redis")
+async def set_display_names(guild_id: int, names: dict[str, str], ttl: int) -> None:
+    """
+    Cache the display names of users in a guild with an expiry.
+
+    Args:
+        guild_id (int): The ID of the guild the names belong to.
+        names (dict[str, str]): A mapping of user IDs to display names.
+        ttl (int): The number of seconds to keep the names.
+    """
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(f"display_names:{guild_id}", mapping=names)
+        pipe.hexpire(f"display_names:{guild_id}", ttl, *names.keys())
+        await pipe.execute()
 
 
 # Resource Management
 
-async def add_resource(resource_hash: str) -> None:
+# A perceptual hash is split into DUPLICATE_DISTANCE + 1 chunks. Two hashes within DUPLICATE_DISTANCE bits 
+# of each other must share at least one identical chunk, so only hashes in a matching chunk bucket are compared.
+_PERCEPTUAL_CHUNKS = DUPLICATE_DISTANCE + 1
+_PERCEPTUAL_BITS = 64
+
+def _perceptual_index_keys(perceptual_hash: str) -> list[str]:
     """
-    Add a resource hash to the database.
+    Get the index buckets a perceptual hash belongs to.
+
+    Args:
+        perceptual_hash (str): The perceptual hash as a hex string.
+
+    Returns:
+        list[str]: One bucket key per chunk of the hash.
+    """
+    value = int(perceptual_hash, 16)
+    bounds = [round(i * _PERCEPTUAL_BITS / _PERCEPTUAL_CHUNKS) for i in range(_PERCEPTUAL_CHUNKS + 1)]
+    keys = []
+
+    for i in range(_PERCEPTUAL_CHUNKS):
+        chunk = (value >> bounds[i]) & ((1 << (bounds[i + 1] - bounds[i])) - 1)
+        keys.append(f"perceptual_index:{_PERCEPTUAL_CHUNKS}:{i}:{chunk:x}")
+
+    return keys
+
+@metrics.timed_stage("redis")
+async def add_resource(resource_hash: str, perceptual_hash: str) -> bool:
+    """
+    Add a resource hash and its perceptual hash to the database. Only one of several concurrent 
+    callers adding the same resource, from any process, is told it added it.
 
     Args:
         resource_hash (str): The hash of the resource to add.
+        perceptual_hash (str): The perceptual hash of the resource to add.
+
+    Returns:
+        bool: True if the resource was added, False if it was already stored.
     """
-    await r.sadd("analyzed_images", resource_hash)
-    
-async def check_resource(resource_hash: str) -> bool:
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.sadd("analyzed_images", resource_hash)
+        pipe.hset("perceptual_hashes", perceptual_hash, resource_hash)
+        for key in _perceptual_index_keys(perceptual_hash):
+            pipe.sadd(key, perceptual_hash)
+        added, *_ = await pipe.execute()
+
+    return added == 1
+
+@metrics.timed_stage("redis")
+async def find_resource(resource_hash: str, perceptual_hash: str | None = None) -> str | None:
     """
-    Check if a resource hash is already stored in the database.
+    Find a stored resource that matches the given one. Only identical resources are matched unless
+    a perceptual hash is given, in which case resources within DUPLICATE_DISTANCE are matched as well.
 
     Args:
-        resource_hash (str): The hash of the resource to check.
+        resource_hash (str): The hash of the resource to find.
+        perceptual_hash (str | None, optional): The perceptual hash of the resource to find. Defaults to None.
 
     Returns:
-        bool: True if the resource hash exists, False otherwise.
+        str | None: The hash of the closest matching stored resource, or None if there is no match.
     """
-    exists = await r.sismember("analyzed_images", resource_hash)
-    
-    return bool(exists)
+    if await r.sismember("analyzed_images", resource_hash):
+        return resource_hash
+    if perceptual_hash is None:
+        return None
+
+    value = int(perceptual_hash, 16)
+    candidates = await r.sunion(_perceptual_index_keys(perceptual_hash))
+    distances = [((int(candidate, 16) ^ value).bit_count(), candidate) for candidate in candidates]
+    matches = [match for match in distances if match[0] <= DUPLICATE_DISTANCE]
+    if not matches:
+        return None
+
+    return await r.hget("perceptual_hashes", min(matches)[1])
+
+
+# Sharding
+
+@metrics.timed_stage("redis")
+async def claim_identify(bucket: int, interval: float) -> bool:
+    """
+    Claim the next IDENTIFY of a gateway rate limit bucket, shared by all processes of the bot.
+
+    Args:
+        bucket (int): The rate limit bucket, the shard ID modulo the bot's max_concurrency.
+        interval (float): Seconds before the bucket can be claimed again.
+
+    Returns:
+        bool: True if the bucket was claimed, False if another shard identified within the interval.
+    """
+    return bool(await r.set(f"identify:{bucket}", 1, nx=True, px=int(interval * 1000)))
+
+
+# Job Queue
+
+@metrics.timed_stage("redis")
+async def create_job_group() -> None:
+    """
+    Create the analysis job stream and its worker consumer group if they do not exist yet.
+    """
+    try:
+        await r.xgroup_create("analysis_jobs", "analysis_workers", id="0", mkstream=True)
+    except ResponseError as error:
+        if "BUSYGROUP" not in str(error):
+            raise
+
+@metrics.timed_stage("redis")
+async def add_job(fields: dict[str, str]) -> str:
+    """
+    Add an analysis job to the stream.
+
+    Args:
+        fields (dict[str, str]): The fields describing the job.
+
+    Returns:
+        str: The ID of the job.
+    """
+    return await r.xadd("analysis_jobs", fields)
+
+@metrics.timed_stage("redis")
+async def count_jobs() -> int:
+    """
+    Count the analysis jobs that are waiting or running. Finished jobs are removed from the stream.
+
+    Returns:
+        int: The number of unfinished jobs.
+    """
+    return await r.xlen("analysis_jobs")
+
+@metrics.timed_stage("redis")
+async def read_jobs(consumer: str, count: int, timeout: float) -> list[tuple[str, dict[str, str]]]:
+    """
+    Read new analysis jobs for a worker, waiting for some to arrive if there are none.
+
+    Args:
+        consumer (str): The name of the worker.
+        count (int): The maximum number of jobs to read.
+        timeout (float): Seconds to wait for a job.
+
+    Returns:
+        list[tuple[str, dict[str, str]]]: The ID and fields of each job read.
+    """
+    response = await r.xreadgroup("analysis_workers", consumer, {"analysis_jobs": ">"}, count=count, block=int(timeout * 1000))
+
+    return response[0][1] if response else []
+
+@metrics.timed_stage("redis")
+async def claim_stalled_jobs(consumer: str, min_idle: float, count: int) -> list[tuple[str, dict[str, str], int]]:
+    """
+    Take over analysis jobs whose worker has not sent a heartbeat for a while.
+
+    Args:
+        consumer (str): The name of the worker taking over the jobs.
+        min_idle (float): Seconds since the last heartbeat for a job to count as stalled.
+        count (int): The maximum number of jobs to take over.
+
+    Returns:
+        list[tuple[str, dict[str, str], int]]: The ID, fields and number of deliveries so far of each job.
+    """
+    _, jobs, *_ = await r.xautoclaim("analysis_jobs", "analysis_workers", consumer, int(min_idle * 1000), count=count)
+    if not jobs:
+        return []
+
+    async with batch() as pipe:
+        for job_id, _ in jobs:
+            pipe.xpending_range("analysis_jobs", "analysis_workers", min=job_id, max=job_id, count=1)
+        pending = await pipe.execute()
+
+    return [
+        (job_id, fields, entries[0]["times_delivered"] if entries else 1)
+        for (job_id, fields), entries in zip(jobs, pending)
+    ]
+
+@metrics.timed_stage("redis")
+async def touch_jobs(consumer: str, job_ids: list[str]) -> None:
+    """
+    Send a heartbeat for analysis jobs a worker is still running, so they are not taken over.
+
+    Args:
+        consumer (str): The name of the worker running the jobs.
+        job_ids (list[str]): The IDs of the jobs.
+    """
+    await r.xclaim("analysis_jobs", "analysis_workers", consumer, 0, job_ids, justid=True)
+
+@metrics.timed_stage("redis")
+async def finish_job(job_id: str) -> None:
+    """
+    Acknowledge an analysis job and remove it from the stream.
+
+    Args:
+        job_id (str): The ID of the job.
+    """
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.xack("analysis_jobs", "analysis_workers", job_id)
+        pipe.xdel("analysis_jobs", job_id)
+        await pipe.execute()
+
+
+# Analysis Cache
+
+@metrics.timed_stage("redis")
+async def get_cached_analysis(image_hash: str) -> str | None:
+    """
+    Retrieve a cached analysis for an image.
+
+    Args:
+        image_hash (str): The hash of the analyzed image.
+
+    Returns:
+        str | None: The analysis serialized as JSON, or None if it is not cached.
+    """
+    return await r.hget("analysis_cache", image_hash)
+
+@metrics.timed_stage("redis")
+async def cache_analysis(image_hash: str, serialized: str, ttl: int) -> None:
+    """
+    Store an analysis for an image with an expiry.
+
+    Args:
+        image_hash (str): The hash of the analyzed image.
+        serialized (str): The analysis serialized as JSON.
+        ttl (int): The number of seconds to keep the entry.
+    """
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset("analysis_cache", image_hash, serialized)
+        pipe.hexpire("analysis_cache", ttl, image_hash)
+        await pipe.execute()
+
+@metrics.timed_stage("redis")
+async def count_cached_analyses() -> int:
+    """
+    Count the cached analyses in the database.
+
+    Returns:
+        int: The number of cached analyses.
+    """
+    return await r.hlen("analysis_cache")
+
+@metrics.timed_stage("redis")
+async def clear_analysis_cache() -> None:
+    """
+    Clear all cached analyses from the database.
+    """
+    await r.delete("analysis_cache")
 
 
 # Maintenance functions
 
+@metrics.timed_stage("redis")
 async def clear_scores() -> None:
     """
-    Clear all user scores from the database.
+    Clear all user scores, guild and window leaderboards and score event logs from the database.
     """
-    await r.delete("score_sums", "analysis_counts", "average_scores")
-
+    keys = [
+        key for pattern in ("score_sums:*", "analysis_counts:*", "average_scores:*", "score_events:*")
+        async for key in r.scan_iter(pattern)
+    ]
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.delete("score_sums", "analysis_counts", "average_scores", *keys)
+        pipe.incr(_SCORE_VERSION)
+        _, version = await pipe.execute()
+
+    await r.publish(_SCORE_VERSION_CHANNEL, version)
+
+@metrics.timed_stage("redis")
 async def clear_resources() -> None:
     """
     Clear all stored resource hashes from the database.
     """
-    await r.delete("analyzed_images")
+    index_keys = [key async for key in r.scan_iter("perceptual_index:*")]
+    await r.delete("analyzed_images", "perceptual_hashes", *index_keys)
 
+@metrics.timed_stage("redis")
 async def clear_database() -> None:
     """
-    Flush all data from the Redis database.
+    Flush all data from the Redis database. The score version is kept, so processes caching rendered scores drop them.
     """
-    await r.flushdb()
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.get(_SCORE_VERSION)
+        pipe.flushdb()
+        version, _ = await pipe.execute()
+
+    await r.publish(_SCORE_VERSION_CHANNEL, await r.incrby(_SCORE_VERSION, int(version or 0) + 1))
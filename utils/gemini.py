@@ -1,78 +1,436 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import json
 import os
-from google import genai
-from google.genai import types
+import random
+import re
+from typing import TYPE_CHECKING, Awaitable, Callable
 from pydantic import BaseModel
-from dotenv import load_dotenv
 
-from config import GEMINI_PROMPT
-from utils import image
+from config import (GEMINI_MODEL, GEMINI_PROMPT, GEMINI_PROMPT_CACHE, GEMINI_PROMPT_CACHE_TTL, GEMINI_PROMPT_CACHE_RENEW,
+                    GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE, GEMINI_ESTIMATED_TOKENS,
+                    GEMINI_MAX_RETRIES, GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_CAP)
+from utils import image, metrics, system
+from utils.ratelimit import Limiter
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import errors, types
+
 
+# The SDK takes most of the bot's import time, so it is only imported once connect() is called
+client: genai.Client | None = None
+_connecting: asyncio.Task | None = None
+limiter = Limiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE)
+for field in limiter.stats():
+    metrics.GEMINI_LIMITER.labels(field).set_function(lambda field=field: limiter.stats()[field])
 
-load_dotenv(override=True)
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+_CACHE_STATUS_CODES = {403, 404} # Returned when the cached prompt expired or was deleted
+
+_prompt_cache: types.CachedContent | None = None
+_prompt_cache_task: asyncio.Task | None = None
+_prompt_cache_lost = asyncio.Event()
+_prompt_cache_stats = {"active": 0, "hits": 0, "misses": 0, "tokens_saved": 0}
+for field in _prompt_cache_stats:
+    metrics.GEMINI_PROMPT_CACHE.labels(field).set_function(lambda field=field: _prompt_cache_stats[field])
     
 class AnalysisSchema(BaseModel):
     """
     Schema for parsing the analysis response from the Gemini API.
 
+    The fields are generated in order, so the score arrives first when the response is streamed.
+
     Attributes:
-        analysis (str): The analysis result as a string.
         score (int): The score associated with the analysis.
         positives (list[str]): A list of positive aspects identified.
         negatives (list[str]): A list of negative aspects identified.
+        analysis (str): The analysis result as a string.
     """
-    analysis: str
     score: int
     positives: list[str]
     negatives: list[str]
+    analysis: str
 
-async def request(image_url: str) -> AnalysisSchema:
+@functools.cache
+def _generate_config() -> dict:
     """
-    Sends a request to the Gemini API to analyze an image.
+    Builds the config shared by all generate content requests.
+
+    Returns:
+        dict: The response schema and safety settings.
+    """
+    from google.genai import types
+
+    return {
+        'response_mime_type': 'application/json',
+        'response_schema': AnalysisSchema,
+        'safety_settings': [
+            types.SafetySetting(category=category, threshold=types.HarmBlockThreshold.BLOCK_NONE)
+            for category in (
+                types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY
+            )
+        ]
+    }
+
+_FIELD_PATTERN = re.compile(r'"(score|positives|negatives|analysis)"\s*:\s*')
+_decoder = json.JSONDecoder()
+
+def _create_client() -> genai.Client:
+    """
+    Imports the SDK and creates a client configured from the environment (GEMINI_API_KEY, GEMINI_BASE_URL).
+
+    Returns:
+        genai.Client: The new client.
+    """
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(
+        api_key=os.getenv("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(base_url=os.getenv("GEMINI_BASE_URL"))
+    )
+
+async def connect() -> None:
+    """
+    Creates the client in a worker thread if not already created, so importing the SDK does not block the event loop. 
+    Concurrent callers wait for the same client.
+    """
+    global client, _connecting
+    if client is not None:
+        return
+
+    if _connecting is None:
+        _connecting = asyncio.create_task(asyncio.to_thread(_create_client))
+    try:
+        client = await asyncio.shield(_connecting)
+    except Exception:
+        _connecting = None
+        raise
+
+async def _create_prompt_cache() -> types.CachedContent:
+    """
+    Stores the prompt in a Gemini context cache so requests can reference it instead of sending it.
+
+    Returns:
+        types.CachedContent: The handle of the cached prompt.
+    """
+    from google.genai import types
+
+    return await client.aio.caches.create(
+        model=GEMINI_MODEL,
+        config=types.CreateCachedContentConfig(
+            display_name="wruf-prompt",
+            contents=[types.Content(role="user", parts=[types.Part.from_text(text=GEMINI_PROMPT)])],
+            ttl=f"{GEMINI_PROMPT_CACHE_TTL}s"
+        )
+    )
+
+async def _keep_prompt_cache() -> None:
+    """
+    Creates the cached prompt and renews it before it expires, creating it again if it was lost. 
+    Requests send the prompt inline while there is no cached prompt.
+    """
+    global _prompt_cache
+    await connect()
+    from google.genai import types
+
+    while True:
+        _prompt_cache_lost.clear()
+        if _prompt_cache is not None:
+            try:
+                _prompt_cache = await client.aio.caches.update(
+                    name=_prompt_cache.name,
+                    config=types.UpdateCachedContentConfig(ttl=f"{GEMINI_PROMPT_CACHE_TTL}s")
+                )
+            except Exception as error:
+                system.log(1, f"Could not renew the cached Gemini prompt: {error}")
+                _prompt_cache = None
+
+        if _prompt_cache is None:
+            try:
+                _prompt_cache = await _create_prompt_cache()
+                tokens = _prompt_cache.usage_metadata.total_token_count if _prompt_cache.usage_metadata else "?"
+                system.log(0, f"Cached the Gemini prompt ({tokens} tokens) as {_prompt_cache.name}")
+            except Exception as error:
+                system.log(1, f"Could not cache the Gemini prompt, sending it inline: {error}")
+
+        _prompt_cache_stats["active"] = int(_prompt_cache is not None)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_prompt_cache_lost.wait(), max(GEMINI_PROMPT_CACHE_TTL - GEMINI_PROMPT_CACHE_RENEW, 1))
+
+def start() -> None:
+    """
+    Starts keeping the prompt in a Gemini context cache, if enabled. Does nothing if already started.
+    """
+    global _prompt_cache_task
+    if GEMINI_PROMPT_CACHE and _prompt_cache_task is None:
+        _prompt_cache_task = asyncio.get_running_loop().create_task(_keep_prompt_cache())
+
+async def close() -> None:
+    """
+    Stops renewing the cached prompt and deletes it.
+    """
+    global _prompt_cache, _prompt_cache_task
+    if _prompt_cache_task is not None:
+        _prompt_cache_task.cancel()
+        _prompt_cache_task = None
+
+    if _prompt_cache is not None:
+        from google.genai import errors
+
+        with contextlib.suppress(errors.APIError):
+            await client.aio.caches.delete(name=_prompt_cache.name)
+        _prompt_cache = None
+        _prompt_cache_stats["active"] = 0
+
+def prompt_cache_stats() -> dict[str, int]:
+    """
+    Returns the state of the prompt cache.
+
+    Returns:
+        dict[str, int]: Whether a cached prompt is active, the requests that did and did not read it, 
+            and the prompt tokens read from it instead of being sent.
+    """
+    return dict(_prompt_cache_stats)
+
+def _request_contents(payload: image.ImagePayload, cached_prompt: str | None) -> tuple[list, dict]:
+    """
+    Builds the contents and config of a request, referencing the cached prompt or sending the prompt inline.
+
+    Args:
+        payload (image.ImagePayload): The fetched image to be analyzed.
+        cached_prompt (str | None): The name of the cached prompt, or None to send the prompt inline.
+
+    Returns:
+        tuple[list, dict]: The contents and config of the request.
+    """
+    from google.genai import types
+
+    image_part = types.Part.from_bytes(data=payload.read(), mime_type=payload.mime_type)
+    if cached_prompt is None:
+        return [GEMINI_PROMPT, image_part], _generate_config()
+
+    return [image_part], {**_generate_config(), 'cached_content': cached_prompt}
+
+async def _generate(payload: image.ImagePayload, cached_prompt: str | None) -> tuple[AnalysisSchema, types.GenerateContentResponseUsageMetadata | None]:
+    """
+    Sends a single generate content request for an image.
 
     Args:
-        image_url (str): The URL of the image to be analyzed.
+        payload (image.ImagePayload): The fetched image to be analyzed.
+        cached_prompt (str | None): The name of the cached prompt, or None to send the prompt inline.
+
+    Returns:
+        tuple[AnalysisSchema, types.GenerateContentResponseUsageMetadata | None]: The parsed analysis and the token usage.
+    """
+    contents, config = _request_contents(payload, cached_prompt)
+    response = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+
+    return response.parsed, response.usage_metadata
+
+def _partial_fields(text: str) -> dict:
+    """
+    Extracts the fields that can already be read from an incomplete JSON response.
+
+    Args:
+        text (str): The response text received so far.
+
+    Returns:
+        dict: The fields whose values are complete, plus the analysis received so far if it is still streaming.
+    """
+    fields = {}
+
+    for match in _FIELD_PATTERN.finditer(text):
+        try:
+            value, end = _decoder.raw_decode(text, match.end())
+            if isinstance(value, (int, float)) and end == len(text):
+                break # A number at the very end may still be missing digits
+            fields[match.group(1)] = value
+        except json.JSONDecodeError:
+            if match.group(1) == "analysis" and text.startswith('"', match.end()):
+                partial = text[match.end():].rstrip("\\")
+                try:
+                    fields["analysis"] = json.loads(partial + '"')
+                except json.JSONDecodeError:
+                    pass
+            break
+
+    return fields
+
+async def _generate_stream(payload: image.ImagePayload, cached_prompt: str | None, 
+                           on_partial: Callable[[dict], Awaitable[None]]) -> tuple[AnalysisSchema, types.GenerateContentResponseUsageMetadata | None]:
+    """
+    Sends a single streaming generate content request for an image, reporting the fields as they arrive.
+
+    Args:
+        payload (image.ImagePayload): The fetched image to be analyzed.
+        cached_prompt (str | None): The name of the cached prompt, or None to send the prompt inline.
+        on_partial (Callable[[dict], Awaitable[None]]): Called with the fields received so far whenever they change.
+
+    Returns:
+        tuple[AnalysisSchema, types.GenerateContentResponseUsageMetadata | None]: The parsed analysis and the token usage.
+    """
+    contents, config = _request_contents(payload, cached_prompt)
+    stream = await client.aio.models.generate_content_stream(model=GEMINI_MODEL, contents=contents, config=config)
+
+    text = ""
+    fields = {}
+    usage = None
+    async for chunk in stream:
+        if chunk.usage_metadata is not None:
+            usage = chunk.usage_metadata
+        if not chunk.text:
+            continue
+
+        text += chunk.text
+        new_fields = _partial_fields(text)
+        if new_fields != fields:
+            fields = new_fields
+            await on_partial(fields)
+
+    return AnalysisSchema.model_validate_json(text), usage
+
+async def _send(payload: image.ImagePayload, on_partial: Callable[[dict], Awaitable[None]] | None) -> tuple[AnalysisSchema, types.GenerateContentResponseUsageMetadata | None]:
+    """
+    Sends a single request for an image using the cached prompt if there is one, 
+    and sends it again with the prompt inline if the cached prompt was lost.
+
+    Args:
+        payload (image.ImagePayload): The fetched image to be analyzed.
+        on_partial (Callable[[dict], Awaitable[None]] | None): If given, the response is streamed and this is 
+            called with the fields received so far whenever they change.
+
+    Returns:
+        tuple[AnalysisSchema, types.GenerateContentResponseUsageMetadata | None]: The parsed analysis and the token usage.
+    """
+    from google.genai import errors
+
+    global _prompt_cache
+    cached = _prompt_cache
+    cached_prompt = cached.name if cached is not None else None
+    try:
+        if on_partial is None:
+            return await _generate(payload, cached_prompt)
+        return await _generate_stream(payload, cached_prompt, on_partial)
+    except errors.APIError as error:
+        if cached is None or error.code not in _CACHE_STATUS_CODES:
+            raise
+
+        system.log(1, f"The cached Gemini prompt was rejected, sending it inline: {error.message}")
+        if _prompt_cache is cached:
+            _prompt_cache = None
+            _prompt_cache_stats["active"] = 0
+            _prompt_cache_lost.set()
+        return await _send(payload, on_partial)
+
+def share_quota(fraction: float) -> None:
+    """
+    Limits this process to a fraction of the quota, for when several processes use the same API key.
+
+    Args:
+        fraction (float): The fraction of the quota this process may use.
+    """
+    global limiter
+    limiter = Limiter(
+        max(1, int(GEMINI_REQUESTS_PER_MINUTE * fraction)), 
+        max(GEMINI_ESTIMATED_TOKENS, int(GEMINI_TOKENS_PER_MINUTE * fraction))
+    )
+
+def _retry_after(error: errors.APIError) -> float | None:
+    """
+    Reads the retry delay suggested by a failed response, if there is one.
+
+    Args:
+        error (errors.APIError): The error returned by the Gemini API.
+
+    Returns:
+        float | None: The suggested number of seconds to wait, or None if no hint was given.
+    """
+    headers = getattr(error.response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass
+
+    body = error.details if isinstance(error.details, dict) else {}
+    for detail in body.get("error", body).get("details", []):
+        if detail.get("@type", "").endswith("RetryInfo"):
+            try:
+                return float(detail.get("retryDelay", "").rstrip("s"))
+            except ValueError:
+                return None
+
+    return None
+
+def _backoff(attempt: int, error: errors.APIError) -> float:
+    """
+    Calculates how long to wait before retrying, using jittered exponential backoff and any retry hint.
+
+    Args:
+        attempt (int): The zero-based number of the attempt that failed.
+        error (errors.APIError): The error returned by the Gemini API.
+
+    Returns:
+        float: The number of seconds to wait.
+    """
+    delay = random.uniform(0, min(GEMINI_BACKOFF_CAP, GEMINI_BACKOFF_BASE * 2 ** attempt))
+    retry_after = _retry_after(error)
+
+    return max(delay, retry_after) if retry_after is not None else delay
+
+async def request(payload: image.ImagePayload, on_partial: Callable[[dict], Awaitable[None]] | None = None) -> AnalysisSchema:
+    """
+    Sends a request to the Gemini API to analyze an image, pacing it to the quota and retrying 
+    rate limited or transient failures.
+
+    Args:
+        payload (image.ImagePayload): The fetched image to be analyzed.
+        on_partial (Callable[[dict], Awaitable[None]], optional): If given, the response is streamed and this is 
+            called with the fields received so far whenever they change. Defaults to None.
 
     Returns:
         AnalysisSchema: The parsed analysis result from the Gemini API.
 
     Raises:
-        UserInputError: If the fetched content type is not supported.
-    """
-    image_content, content_type = await image.fetch(image_url)
-
-    response = await client.aio.models.generate_content(
-        model="gemini-2.0-flash-exp",
-        contents=[GEMINI_PROMPT,
-                types.Part.from_bytes(data=image_content, mime_type=content_type)],
-        config={
-            'response_mime_type': 'application/json',
-            'response_schema': AnalysisSchema,
-            'safety_settings': [
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                )
-            ]
-        }
-    )
-    
-    analysis: AnalysisSchema = response.parsed
+        errors.APIError: If the request fails with a non transient error or after all retries.
+    """
+    await connect()
+    from google.genai import errors
+
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        with metrics.timed("gemini.wait_for_quota"):
+            await limiter.acquire(GEMINI_ESTIMATED_TOKENS)
+        try:
+            with metrics.timed("gemini.request"):
+                analysis, usage = await _send(payload, on_partial)
+        except errors.APIError as error:
+            if error.code == 429:
+                limiter.throttled += 1
+            if error.code not in _RETRY_STATUS_CODES or attempt == GEMINI_MAX_RETRIES:
+                limiter.failures += 1
+                raise
+
+            delay = _backoff(attempt, error)
+            if error.code == 429:
+                limiter.block(delay)
+            limiter.retries += 1
+            await asyncio.sleep(delay)
+            continue
+
+        if usage is not None and usage.total_token_count is not None:
+            limiter.settle(GEMINI_ESTIMATED_TOKENS, usage.total_token_count)
+        if usage is not None and usage.cached_content_token_count:
+            _prompt_cache_stats["hits"] += 1
+            _prompt_cache_stats["tokens_saved"] += usage.cached_content_token_count
+        else:
+            _prompt_cache_stats["misses"] += 1
 
-    return analysis
+        return analysis
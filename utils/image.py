@@ -1,11 +1,66 @@
 import aiohttp
+import asyncio
 import hashlib
+import io
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from typing import BinaryIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+from pillow_heif import register_heif_opener
 
-from config import SUPPORTED_IMAGE_TYPES
+from config import (SUPPORTED_IMAGE_TYPES, IMAGE_MAX_BYTES, IMAGE_SPOOL_BYTES, IMAGE_CHUNK_BYTES,
+                    IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY)
 from exceptions import UserInputError
+from utils import metrics, system
+
+
+register_heif_opener()
 
 session: aiohttp.ClientSession | None = None
 
+@dataclass(frozen=True)
+class ImagePayload:
+    """
+    A fetched image that is passed through the analysis pipeline.
+
+    Can be used as a context manager to close the underlying file.
+
+    Attributes:
+        file (BinaryIO): The image content, held in memory or spilled to disk if large.
+        size (int): The size of the image content in bytes.
+        mime_type (str): The content type of the image.
+        hash (str): The hash of the image content.
+        perceptual_hash (str): The perceptual hash of the image, similar for visually similar images.
+    """
+    file: BinaryIO
+    size: int
+    mime_type: str
+    hash: str
+    perceptual_hash: str
+
+    def read(self) -> bytes:
+        """
+        Reads the whole image content.
+
+        Returns:
+            bytes: The image content.
+        """
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        """
+        Closes the underlying file, removing it from disk if it was spilled.
+        """
+        self.file.close()
+
+    def __enter__(self) -> "ImagePayload":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
 def create_session() -> None:
     """
     Creates a new aiohttp session if one does not already exist.
@@ -22,18 +77,18 @@ async def close_session() -> None:
     if session and not session.closed:
         await session.close()
 
-async def fetch(image_url: str) -> tuple[bytes, str]:
+async def _download(image_url: str) -> tuple[BinaryIO, int, str, str]:
     """
-    Fetches the content of an image from the given URL.
+    Streams an image into a spooled temporary file, hashing it as it arrives.
 
     Args:
-        image_url (str): The URL of the image to fetch.
-    
+        image_url (str): The URL of the image to download.
+
     Returns:
-        tuple[bytes, str]: A tuple containing the image content as bytes and the content type as a string.
-    
+        tuple[BinaryIO, int, str, str]: The file holding the content, its size, the content type and the content hash.
+
     Raises:
-        UserInputError: If the fetched content type is not supported.
+        UserInputError: If the content type is not supported or the image is too large.
     """
     global session 
     async with session.get(image_url) as response:
@@ -41,27 +96,135 @@ async def fetch(image_url: str) -> tuple[bytes, str]:
             raise Exception(f"Failed to fetch image: {response.status}")
 
         mime_type = response.content_type
-        image_bytes = await response.read()
-    
-    if mime_type not in SUPPORTED_IMAGE_TYPES:
-        raise UserInputError(f"Unsupported image type: {mime_type}")
+        if mime_type not in SUPPORTED_IMAGE_TYPES:
+            raise UserInputError(f"Unsupported image type: {mime_type}")
+        if response.content_length is not None and response.content_length > IMAGE_MAX_BYTES:
+            raise UserInputError(f"The image is larger than {IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+
+        image_file = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_BYTES)
+        image_hash = hashlib.blake2b(digest_size=16)
+        size = 0
+        try:
+            async for chunk in response.content.iter_chunked(IMAGE_CHUNK_BYTES):
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES:
+                    raise UserInputError(f"The image is larger than {IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+                image_hash.update(chunk)
+                image_file.write(chunk)
+        except BaseException:
+            image_file.close()
+            raise
 
-    return image_bytes, mime_type
+    return image_file, size, mime_type, image_hash.hexdigest()
 
-async def get_hash(image_url: str) -> str:
+async def fetch(image_url: str) -> ImagePayload:
     """
-    Fetches an image from the given URL, processes it, and computes its perceptual hash.
-    
+    Streams the content of an image from the given URL into a spooled temporary file, hashing it as it arrives.
+    The headers are checked before the body is read, and the download is aborted once it exceeds IMAGE_MAX_BYTES.
+    The perceptual hash is computed in a worker thread to keep the event loop free.
+
     Args:
-        image_url (str): The URL of the image to be fetched and hashed.
+        image_url (str): The URL of the image to fetch.
     
     Returns:
-        str: The perceptual hash of the image as a string.
+        ImagePayload: The image content, content type and hashes. The caller is responsible for closing it.
     
     Raises:
-        UserInputError: If the fetched content type is not supported.
+        UserInputError: If the content type is not supported, the image is too large or the image cannot be decoded.
     """
-    image_bytes = (await fetch(image_url))[0]
-    image_hash = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
-    
-    return image_hash
+    with metrics.timed("image.download"):
+        image_file, size, mime_type, image_hash = await _download(image_url)
+
+    payload = ImagePayload(image_file, size, mime_type, image_hash, "")
+    try:
+        with metrics.timed("image.perceptual_hash"):
+            perceptual_hash = await asyncio.to_thread(get_perceptual_hash, image_file)
+    except BaseException:
+        payload.close()
+        raise
+
+    return replace(payload, perceptual_hash=perceptual_hash)
+
+def get_perceptual_hash(image_file: BinaryIO) -> str:
+    """
+    Computes the 64 bit difference hash (dHash) of an image. Recompressed, resized or slightly altered
+    copies of an image have hashes within a small Hamming distance of each other.
+
+    Args:
+        image_file (BinaryIO): The image content to hash.
+
+    Returns:
+        str: The perceptual hash of the image as a 16 character hex string.
+
+    Raises:
+        UserInputError: If the image cannot be decoded.
+    """
+    import numpy as np # Imported on first use, in a worker thread, as it is slow to import
+
+    image_file.seek(0)
+    try:
+        with Image.open(image_file) as img:
+            img.draft("L", (64, 64)) # Let JPEG decode at a reduced size
+            pixels = np.asarray(img.convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    except (UnidentifiedImageError, OSError):
+        raise UserInputError("The image could not be read")
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+def _normalize(image_file: BinaryIO) -> bytes:
+    """
+    Decodes an image, applies its orientation, caps its longest side and re-encodes it without metadata.
+
+    Args:
+        image_file (BinaryIO): The image content to normalize.
+
+    Returns:
+        bytes: The re-encoded image content.
+
+    Raises:
+        UserInputError: If the image cannot be decoded.
+    """
+    image_file.seek(0)
+    try:
+        with Image.open(image_file) as img:
+            img.draft("RGB", (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+            has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+    except (UnidentifiedImageError, OSError):
+        raise UserInputError("The image could not be read")
+
+    output = io.BytesIO()
+    img.save(output, IMAGE_FORMAT, quality=IMAGE_QUALITY)
+
+    return output.getvalue()
+
+async def prepare(payload: ImagePayload) -> ImagePayload:
+    """
+    Normalizes an image in a worker thread so it is smaller to upload. The original is kept if 
+    normalizing would not make it smaller.
+
+    Args:
+        payload (ImagePayload): The fetched image.
+
+    Returns:
+        ImagePayload: The image with normalized content. The hashes still refer to the original image.
+
+    Raises:
+        UserInputError: If the image cannot be decoded.
+    """
+    start = time.perf_counter()
+    with metrics.timed("image.prepare"):
+        image_bytes = await asyncio.to_thread(_normalize, payload.file)
+    elapsed = time.perf_counter() - start
+
+    if len(image_bytes) >= payload.size:
+        system.log(0, f"Image kept at {payload.size} bytes, normalizing took {elapsed * 1000:.0f} ms")
+        return payload
+
+    system.log(0, f"Image reduced by {payload.size - len(image_bytes)} bytes to {len(image_bytes)} bytes in {elapsed * 1000:.0f} ms")
+
+    return replace(payload, file=io.BytesIO(image_bytes), size=len(image_bytes), mime_type=Image.MIME[IMAGE_FORMAT])
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+
+import discord
+from redis.exceptions import RedisError
+
+from config import (MAX_CONCURRENT_ANALYSES, MAX_QUEUED_ANALYSES, INTERACTION_TOKEN_LIFETIME, WORKER_POLL_TIMEOUT,
+                    WORKER_RECLAIM_INTERVAL, WORKER_CLAIM_IDLE, WORKER_MAX_DELIVERIES)
+from exceptions import UserInputError
+from utils import analyzer, database, image, layout, metrics, system
+from utils.messages import CoalescedEditor
+
+
+async def enqueue(interaction: discord.Interaction, image_urls: list[str], author_name: str, author_id: int,
+                  guild_id: int | None, deep: bool = False, batch: bool = False) -> None:
+    """
+    Adds an analysis to the job queue, for a worker to run and respond to the interaction with.
+    The interaction must already have been responded to.
+
+    Args:
+        interaction (discord.Interaction): The interaction requesting the analysis.
+        image_urls (list[str]): The URLs of the images to analyze, a single one unless batch is set.
+        author_name (str): The name of the author requesting the analysis.
+        author_id (int): The unique identifier of the author.
+        guild_id (int | None): The ID of the guild the analysis was requested in, None outside of a guild.
+        deep (bool, optional): Whether to include deep analyses in the response. Defaults to False.
+        batch (bool, optional): Whether to analyze the images as a batch. Defaults to False.
+
+    Raises:
+        UserInputError: If the queue is full.
+    """
+    if await database.count_jobs() >= MAX_QUEUED_ANALYSES:
+        raise UserInputError("Too many images are waiting to be analyzed, please try again later")
+
+    await database.add_job({
+        "application_id": str(interaction.application_id),
+        "token": interaction.token,
+        "created": str(interaction.created_at.timestamp()),
+        "image_urls": json.dumps(image_urls),
+        "author_name": author_name,
+        "author_id": str(author_id),
+        "guild_id": str(guild_id or ""),
+        "deep": str(int(deep)),
+        "batch": str(int(batch))
+    })
+
+async def _run_job(job_id: str, fields: dict[str, str], deliveries: int) -> None:
+    """
+    Runs a single analysis job and edits the interaction response with its progress and result.
+    A job that fails unexpectedly is left unacknowledged so it is retried, up to WORKER_MAX_DELIVERIES times.
+
+    Args:
+        job_id (str): The ID of the job.
+        fields (dict[str, str]): The fields describing the job.
+        deliveries (int): The number of times the job has been delivered, including this one.
+    """
+    webhook = discord.Webhook.partial(int(fields["application_id"]), fields["token"], session=image.session)
+
+    async def edit(**message):
+        with metrics.timed("discord.edit"):
+            await webhook.edit_message("@original", **message)
+
+    editor = CoalescedEditor(edit)
+
+    if time.time() - float(fields["created"]) > INTERACTION_TOKEN_LIFETIME:
+        system.log(1, f"Dropped analysis job {job_id}, its interaction expired")
+        metrics.JOBS.labels("expired").inc()
+        await database.finish_job(job_id)
+        return
+
+    if deliveries > WORKER_MAX_DELIVERIES:
+        system.log(3, f"Gave up analysis job {job_id} after {deliveries - 1} attempts")
+        metrics.JOBS.labels("abandoned").inc()
+        await database.finish_job(job_id)
+        editor.update(content=layout.error("There was an unexpected error"))
+        await editor.flush()
+        return
+
+    async def show_position(position: int):
+        editor.update(content=layout.queue_position(position))
+
+    async def show_preview(content: str):
+        editor.update(content=content)
+
+    try:
+        messages = await analyzer.analyze(
+            json.loads(fields["image_urls"]), fields["author_name"], int(fields["author_id"]),
+            int(fields["guild_id"]) if fields.get("guild_id") else None, deep=fields["deep"] == "1", batch=fields["batch"] == "1",
+            on_update=show_preview, on_position=show_position
+        )
+    except UserInputError as error:
+        metrics.JOBS.labels("user_error").inc()
+        await database.finish_job(job_id)
+        editor.update(content=layout.error("Invalid input", error))
+        await editor.flush()
+        system.log(1, f"User input error in analysis job {job_id}: {error}")
+        return
+    except Exception as error:
+        system.log(3, f"Analysis job {job_id} failed on attempt {deliveries}: {error}")
+        if deliveries < WORKER_MAX_DELIVERIES:
+            metrics.JOBS.labels("retry").inc()
+            return
+
+        metrics.JOBS.labels("error").inc()
+        await database.finish_job(job_id)
+        editor.update(content=layout.error("There was an unexpected error"))
+        await editor.flush()
+        return
+
+    # Acknowledged before responding, so a failed response does not score the images again
+    await database.finish_job(job_id)
+    metrics.JOBS.labels("success").inc()
+
+    editor.update(content=None, embeds=messages[0])
+    await editor.flush()
+
+    for embeds in messages[1:]:
+        with metrics.timed("discord.send"):
+            await webhook.send(embeds=embeds)
+
+async def _run_job_safely(job_id: str, fields: dict[str, str], deliveries: int) -> None:
+    """
+    Runs a single analysis job, logging errors from responding to the interaction instead of raising them.
+
+    Args:
+        job_id (str): The ID of the job.
+        fields (dict[str, str]): The fields describing the job.
+        deliveries (int): The number of times the job has been delivered, including this one.
+    """
+    try:
+        await _run_job(job_id, fields, deliveries)
+    except Exception as error:
+        system.log(3, f"Could not respond to analysis job {job_id}: {error}")
+
+async def consume(consumer: str) -> None:
+    """
+    Runs analysis jobs from the queue until cancelled, up to MAX_CONCURRENT_ANALYSES at once.
+    Jobs of workers that stopped sending heartbeats are taken over.
+
+    Args:
+        consumer (str): The unique name of this worker.
+    """
+    running: dict[asyncio.Task, str] = {}
+    next_reclaim = 0.0
+
+    while True:
+        try:
+            free = MAX_CONCURRENT_ANALYSES - len(running)
+            jobs = []
+
+            if time.monotonic() >= next_reclaim:
+                next_reclaim = time.monotonic() + WORKER_RECLAIM_INTERVAL
+                if running:
+                    await database.touch_jobs(consumer, list(running.values()))
+                if free > 0:
+                    jobs = await database.claim_stalled_jobs(consumer, WORKER_CLAIM_IDLE, free)
+                    if jobs:
+                        system.log(2, f"Took over {len(jobs)} stalled analysis jobs")
+
+            if free <= 0:
+                await asyncio.wait(running, timeout=WORKER_POLL_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            if not jobs:
+                jobs = [(job_id, fields, 1) for job_id, fields in await database.read_jobs(consumer, free, WORKER_POLL_TIMEOUT)]
+        except RedisError as error:
+            system.log(3, f"Could not read analysis jobs: {error}")
+            await asyncio.sleep(WORKER_POLL_TIMEOUT)
+            if "NOGROUP" in str(error):
+                await database.create_job_group()
+            continue
+
+        for job_id, fields, deliveries in jobs:
+            task = asyncio.create_task(_run_job_safely(job_id, fields, deliveries))
+            running[task] = job_id
+            task.add_done_callback(running.pop)
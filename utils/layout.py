@@ -1,27 +1,196 @@
-def result(score: int, positives: list[str], negatives: list[str]) -> str:
+import discord
+
+from config import MESSAGE_LIMIT, EMBED_DESCRIPTION_LIMIT, EMBED_MESSAGE_LIMIT, EMBEDS_PER_MESSAGE
+
+
+def result(image_url: str, score: int, positives: list[str], negatives: list[str], score_update: str, analysis: str | None = None) -> list[list[discord.Embed]]:
     """
-    Generates a formatted string summarizing the W.R.U.F score, positive factors, and negative factors.
+    Generates the messages showing an analysis result, using as few messages as Discord's limits allow.
+    The first message is meant to replace the initial response, any further messages are sent after it.
 
     Args:
+        image_url (str): The URL of the analyzed image.
         score (int): The W.R.U.F score as a percentage.
         positives (list[str]): A list of positive factors.
         negatives (list[str]): A list of negative factors.
+        score_update (str): The formatted score update of the author.
+        analysis (str | None, optional): The deep analysis to include. Defaults to None.
+
+    Returns:
+        list[list[discord.Embed]]: The embeds of each message.
+    """
+    color = _score_color(score)
+    sections = [(f"W.R.U.F Score: {score}%", _factors(positives, negatives) + "\n\n" + score_update, image_url, color)]
+    if analysis:
+        sections.append((None, analysis, None, color))
+
+    return _pack(sections)
+
+def batch_result(results: list[tuple[str, int, list[str], list[str], str | None]], score: int, score_update: str, skipped: list[str]) -> list[list[discord.Embed]]:
+    """
+    Generates the messages showing the results of analyzing several images together, using as few messages as Discord's limits allow.
+    The first message is meant to replace the initial response, any further messages are sent after it.
+
+    Args:
+        results (list[tuple[str, int, list[str], list[str], str | None]]): The URL, score, positive factors, negative factors
+            and deep analysis (or None) of each analyzed image.
+        score (int): The combined W.R.U.F score of all images.
+        score_update (str): The formatted score update of the author.
+        skipped (list[str]): The reasons images could not be analyzed.
+
+    Returns:
+        list[list[discord.Embed]]: The embeds of each message.
+    """
+    sections = []
+    for i, (image_url, image_score, positives, negatives, analysis) in enumerate(results, 1):
+        color = _score_color(image_score)
+        sections.append((f"Image {i}: W.R.U.F Score: {image_score}%", _factors(positives, negatives), image_url, color))
+        if analysis:
+            sections.append((None, analysis, None, color))
+
+    summary = score_update
+    if skipped:
+        summary += "\n\n⚠️ Skipped:\n" + _bullet_point(skipped)
+    sections.append((f"Combined W.R.U.F Score: {score}%", summary, None, _score_color(score)))
+
+    return _pack(sections)
+
+def _factors(positives: list[str], negatives: list[str]) -> str:
+    """
+    Generates a formatted string listing the positive and negative factors of a result.
+
+    Args:
+        positives (list[str]): A list of positive factors.
+        negatives (list[str]): A list of negative factors.
 
     Returns:
-        str: A formatted string displaying the score, positive factors, and negative factors.
+        str: A formatted string with a bullet list for each kind of factor.
     """
     for list in [positives, negatives]:
         if len(list) == 0:
             list.append("None")
 
     return "\n".join([
-        f"# W.R.U.F Score: {score}%",
         "## ✅ Positive Factors:",
         _bullet_point(positives),
         "## ❌ Negative Factors",
         _bullet_point(negatives)
     ])
 
+def _score_color(score: int) -> discord.Color:
+    """
+    Picks the embed color for a score.
+
+    Args:
+        score (int): The W.R.U.F score.
+
+    Returns:
+        discord.Color: Green for non-negative scores, red otherwise.
+    """
+    return discord.Color.green() if score >= 0 else discord.Color.red()
+
+def _pack(sections: list[tuple[str | None, str, str | None, discord.Color]]) -> list[list[discord.Embed]]:
+    """
+    Packs sections of text into as few messages of embeds as Discord's limits allow. Each section starts a new embed,
+    and long sections continue in further embeds, split between paragraphs.
+
+    Args:
+        sections (list[tuple[str | None, str, str | None, discord.Color]]): The title, text, image URL and color of each section.
+
+    Returns:
+        list[list[discord.Embed]]: The embeds of each message.
+    """
+    messages = [[]]
+
+    for title, text, image_url, color in sections:
+        embed = None
+        for paragraph in _split_paragraphs(text, EMBED_DESCRIPTION_LIMIT) or [""]:
+            used = sum(len(e) for e in messages[-1])
+            if embed is not None and len(embed.description) + len(paragraph) + 2 <= EMBED_DESCRIPTION_LIMIT \
+                    and used + len(paragraph) + 2 <= EMBED_MESSAGE_LIMIT:
+                embed.description += "\n\n" + paragraph
+                continue
+
+            first = embed is None
+            size = len(paragraph) + (len(title) if first and title else 0)
+            if len(messages[-1]) == EMBEDS_PER_MESSAGE or (messages[-1] and used + size > EMBED_MESSAGE_LIMIT):
+                messages.append([])
+
+            embed = discord.Embed(description=paragraph, color=color)
+            if first and title:
+                embed.title = title
+            if first and image_url:
+                embed.set_image(url=image_url)
+            messages[-1].append(embed)
+
+    return messages
+
+def _split_paragraphs(text: str, limit: int) -> list[str]:
+    """
+    Splits text into its paragraphs. Paragraphs longer than the limit are broken between lines, 
+    then between words, into pieces no longer than the limit.
+
+    Args:
+        text (str): The text to split.
+        limit (int): The maximum length of a piece.
+
+    Returns:
+        list[str]: The paragraphs and pieces of text.
+    """
+    paragraphs = []
+
+    for paragraph in text.split("\n\n"):
+        if not paragraph.strip():
+            continue
+        if len(paragraph) <= limit:
+            paragraphs.append(paragraph)
+            continue
+
+        separator = "\n" if "\n" in paragraph else " "
+        current = ""
+        for part in paragraph.split(separator):
+            pieces = _split_paragraphs(part, limit) if separator == "\n" else [part[i:i + limit] for i in range(0, len(part), limit)]
+            for piece in pieces:
+                if current and len(current) + len(separator) + len(piece) <= limit:
+                    current += separator + piece
+                else:
+                    if current:
+                        paragraphs.append(current)
+                    current = piece
+        if current:
+            paragraphs.append(current)
+
+    return paragraphs
+
+def partial_result(score: int | None, positives: list[str] | None, negatives: list[str] | None, analysis: str | None = None) -> str:
+    """
+    Generates a formatted string of a result that is still being generated, limited to the length of one message.
+
+    Args:
+        score (int | None): The W.R.U.F score, or None if it has not arrived yet.
+        positives (list[str] | None): The positive factors, or None if they have not arrived yet.
+        negatives (list[str] | None): The negative factors, or None if they have not arrived yet.
+        analysis (str | None, optional): The analysis received so far, or None if it should not be shown. Defaults to None.
+
+    Returns:
+        str: A formatted string displaying the parts of the result that have arrived.
+    """
+    lines = [
+        f"# W.R.U.F Score: {score}%" if score is not None else "# W.R.U.F Score: 🔄",
+        "## ✅ Positive Factors:",
+        _bullet_point(positives) if positives is not None else "🔄",
+        "## ❌ Negative Factors",
+        _bullet_point(negatives) if negatives is not None else "🔄"
+    ]
+    message = "\n".join(lines)
+
+    if analysis:
+        remaining = MESSAGE_LIMIT - len(message) - 2
+        if remaining > 1:
+            message += "\n\n" + (analysis if len(analysis) <= remaining else analysis[:remaining - 1] + "…")
+
+    return message
+
 def _bullet_point(lst: list) -> str:
     """
     Converts a list of strings into a bullet-point formatted string.
@@ -34,22 +203,27 @@ def _bullet_point(lst: list) -> str:
     """
     return "\n".join(f"- {item}" for item in lst)
 
-def leaderboard(leaderboard: list[tuple[str,int]]) -> str:
+def leaderboard(leaderboard: list[tuple[int, str, float]], page: int, pages: int, period: str = "All Time") -> str:
     """
-    Generates a formatted leaderboard string from a list of tuples.
+    Generates a formatted leaderboard page string from a list of tuples.
 
     Args:
-        leaderboard (list[tuple[str, int]]): A list of tuples where each tuple contains a name and score.
+        leaderboard (list[tuple[int, str, float]]): A list of tuples where each tuple contains a rank, name and score.
+        page (int): The zero-based index of the page.
+        pages (int): The total number of pages.
+        period (str, optional): The title of the period the scores were earned in. Defaults to "All Time".
 
     Returns:
         str: A formatted leaderboard string.
     """
     for i in range(len(leaderboard)):
-        leaderboard[i] = f"{i+1}. **{leaderboard[i][0]}** - **{round(leaderboard[i][1], 2)}** W.R.U.F Points!"
+        rank, name, score = leaderboard[i]
+        leaderboard[i] = f"{rank}. **{name}** - **{round(score, 2)}** W.R.U.F Points!"
 
     return "\n".join([
-        "## W.R.U.F Leaderboard",
-        _bullet_point(leaderboard)
+        f"## W.R.U.F Leaderboard - {period}",
+        _bullet_point(leaderboard),
+        f"-# Page {page + 1}/{pages}"
     ])
 
 def score_update(name: str, old_average: float, new_average: float) -> str:
@@ -66,18 +240,84 @@ def score_update(name: str, old_average: float, new_average: float) -> str:
     """
     return f"**{name}'s** W.R.U.F score went from **{round(old_average, 2)}** to **{round(new_average, 2)}**!"
 
-def score(name: str, score: float) -> str:
+def score(name: str, score: float, rank: int | None = None) -> str:
     """
     Generates a formatted string summarizing a user's score.
 
     Args:
         name (str): The name of the user.
         score (float): The user's score.
+        rank (int | None, optional): The user's zero-based leaderboard position, if they are on the leaderboard. Defaults to None.
 
     Returns:
         str: A formatted string describing the user's score.
     """
-    return f"""**{name}** has a W.R.U.F score of **{round(score, 2)}**!"""
+    message = f"""**{name}** has a W.R.U.F score of **{round(score, 2)}**!"""
+    if rank is not None:
+        message += f" They are **#{rank + 1}** on the leaderboard."
+
+    return message
+
+def queue_position(position: int) -> str:
+    """
+    Generates a formatted string describing an analysis' place in the queue.
+
+    Args:
+        position (int): The one-based position in the queue, or 0 if the analysis is running.
+
+    Returns:
+        str: A formatted queue status message.
+    """
+    if position == 0:
+        return "🔄 Processing..."
+
+    return f"🔄 Waiting in queue, position **{position}**..."
+
+def stats(stages: list[tuple[str, int, float, float]], in_flight: int, queued: int, loop_lag: float, prompt_cache: dict[str, int]) -> str:
+    """
+    Generates a formatted summary of the bot's performance metrics. Stages are listed slowest p95 first,
+    as many as fit in a message.
+
+    Args:
+        stages (list[tuple[str, int, float, float]]): The name, call count, mean and 95th percentile in seconds of each stage.
+        in_flight (int): The number of analyses currently running.
+        queued (int): The number of analyses waiting in the queue.
+        loop_lag (float): The latest event loop lag in seconds.
+        prompt_cache (dict[str, int]): The state of the Gemini prompt cache.
+
+    Returns:
+        str: A formatted stats message.
+    """
+    requests = prompt_cache["hits"] + prompt_cache["misses"]
+    hit_rate = prompt_cache["hits"] / requests * 100 if requests else 0
+    lines = [
+        "## W.R.U.F Stats",
+        f"**{in_flight}** analyses running, **{queued}** queued, event loop lag **{round(loop_lag * 1000, 1)} ms**",
+        f"Prompt cache **{'active' if prompt_cache['active'] else 'inactive'}**, "
+        f"hit rate **{round(hit_rate)}%**, **{prompt_cache['tokens_saved']}** tokens saved",
+        "```",
+        f"{'Stage':<32} {'Calls':>6} {'Mean ms':>9} {'p95 ms':>9}"
+    ]
+    rows = [
+        f"{name:<32} {count:>6} {mean * 1000:>9.1f} {p95 * 1000:>9.0f}"
+        for name, count, mean, p95 in sorted(stages, key=lambda stage: stage[3], reverse=True)
+    ]
+
+    # Room is kept for the closing fence and for a line counting the stages left out
+    used = len("\n".join(lines)) + len("\n```")
+    shown = 0
+    for row in rows:
+        hidden = len(rows) - shown - 1
+        if used + len(row) + 1 + (len(f"\n…and {hidden} more stages") if hidden else 0) > MESSAGE_LIMIT:
+            break
+        used += len(row) + 1
+        shown += 1
+
+    lines += [*rows[:shown], "```"]
+    if shown < len(rows):
+        lines.append(f"…and {len(rows) - shown} more stages")
+
+    return "\n".join(lines)
 
 def error(message: str, description: str = "") -> str:
     """
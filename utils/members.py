@@ -0,0 +1,73 @@
+import asyncio
+import discord
+
+from config import DISPLAY_NAME_TTL
+from utils import database, system
+
+
+_QUERY_CHUNK_SIZE = 100 # Maximum number of user IDs Discord accepts per member request
+
+async def _query_names(guild: discord.Guild, user_ids: list[str]) -> dict[str, str]:
+    """
+    Requests the given members from the gateway in chunks.
+
+    Args:
+        guild (discord.Guild): The guild to request the members from.
+        user_ids (list[str]): The IDs of the members to request.
+
+    Returns:
+        dict[str, str]: A mapping of user IDs to display names for the members that are still in the guild. 
+            Members of a chunk that timed out are omitted.
+    """
+    chunks = [user_ids[i:i + _QUERY_CHUNK_SIZE] for i in range(0, len(user_ids), _QUERY_CHUNK_SIZE)]
+    results = await asyncio.gather(*[
+        guild.query_members(user_ids=[int(user_id) for user_id in chunk], limit=len(chunk), cache=True)
+        for chunk in chunks
+    ], return_exceptions=True)
+
+    names = {}
+    for result in results:
+        # A chunk the gateway did not answer in time is left unresolved, like members that left
+        if isinstance(result, asyncio.TimeoutError):
+            system.log(1, f"Timed out requesting members of guild {guild.id}")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            names.update({str(member.id): member.display_name for member in result})
+
+    return names
+
+async def resolve_names(guild: discord.Guild, user_ids: list[str]) -> dict[str, str]:
+    """
+    Resolves display names for the given users, using the member cache, then the database
+    and finally a bulk member request for any remaining users.
+
+    Args:
+        guild (discord.Guild): The guild the names should be resolved in.
+        user_ids (list[str]): The IDs of the users to resolve.
+
+    Returns:
+        dict[str, str]: A mapping of user IDs to display names. Users that have left the guild are omitted.
+    """
+    names = {}
+    misses = []
+
+    for user_id in user_ids:
+        member = guild.get_member(int(user_id))
+        if member is not None:
+            names[user_id] = member.display_name
+        else:
+            misses.append(user_id)
+
+    if misses:
+        cached = await database.get_display_names(guild.id, misses)
+        names.update(cached)
+        misses = [user_id for user_id in misses if user_id not in cached]
+
+    if misses:
+        fetched = await _query_names(guild, misses)
+        if fetched:
+            await database.set_display_names(guild.id, fetched, DISPLAY_NAME_TTL)
+        names.update(fetched)
+
+    return names
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from config import MESSAGE_EDIT_INTERVAL
+
+
+class CoalescedEditor:
+    """
+    Edits a message at most once per MESSAGE_EDIT_INTERVAL, skipping intermediate contents 
+    that were replaced before they could be shown.
+    """
+    def __init__(self, edit: Callable[..., Awaitable[None]]):
+        self._edit = edit
+        self._pending: dict | None = None
+        self._last_edit = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        """
+        Applies pending contents until there are none left, waiting out the interval between edits.
+        """
+        try:
+            while self._pending is not None:
+                wait = self._last_edit + MESSAGE_EDIT_INTERVAL - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                fields, self._pending = self._pending, None
+                self._last_edit = time.monotonic()
+                await self._edit(**fields)
+        finally:
+            self._task = None
+
+    def update(self, **fields) -> None:
+        """
+        Schedules the message to be edited with the given fields, e.g. content or embeds.
+
+        Args:
+            **fields: The fields to pass to the edit function.
+        """
+        self._pending = fields
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        """
+        Waits until all scheduled contents have been applied.
+        """
+        if self._task is not None:
+            await self._task
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from config import METRICS_HOST, METRICS_PORT, LOOP_LAG_INTERVAL
+
+
+STAGE_SECONDS = Histogram(
+    "wruf_stage_seconds", "Time spent in each stage of the bot", ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+STAGE_ERRORS = Counter("wruf_stage_errors_total", "Stages that ended with an exception", ["stage"])
+COMMANDS = Counter("wruf_commands_total", "Finished commands", ["command", "outcome"])
+COMMAND_SECONDS = Histogram(
+    "wruf_command_seconds", "Time from interaction creation to command completion", ["command"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+)
+COMMANDS_IN_FLIGHT = Gauge("wruf_commands_in_flight", "Commands currently running")
+ANALYSES_IN_FLIGHT = Gauge("wruf_analyses_in_flight", "Analyses currently running")
+ANALYSES_QUEUED = Gauge("wruf_analyses_queued", "Analyses waiting in the queue")
+GEMINI_LIMITER = Gauge("wruf_gemini_limiter", "State of the Gemini rate limiter", ["field"])
+GEMINI_PROMPT_CACHE = Gauge("wruf_gemini_prompt_cache", "State of the Gemini prompt cache", ["field"])
+JOBS = Counter("wruf_jobs_total", "Analysis jobs handled by workers", ["outcome"])
+RENDER_CACHE = Counter("wruf_render_cache_total", "Leaderboard and score responses by whether they were cached", ["result"])
+LOOP_LAG = Gauge("wruf_event_loop_lag_seconds", "How late the event loop woke up from a sleep")
+
+_started = False
+_loop_lag = 0.0
+
+@contextmanager
+def timed(stage: str):
+    """
+    Measures the time spent in a block and counts it as an error if it raises.
+
+    Args:
+        stage (str): The name of the stage being measured.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def timed_stage(prefix: str):
+    """
+    Decorates a coroutine function so every call is measured as the stage "<prefix>.<function name>".
+
+    Args:
+        prefix (str): The prefix of the stage name.
+    """
+    def decorator(func):
+        stage = f"{prefix}.{func.__name__}"
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timed(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def _watch_loop_lag() -> None:
+    """
+    Repeatedly sleeps and records how much later than requested the event loop resumed.
+    """
+    global _loop_lag
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        _loop_lag = max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL)
+        LOOP_LAG.set(_loop_lag)
+
+def loop_lag() -> float:
+    """
+    Returns the latest event loop lag measurement.
+
+    Returns:
+        float: The lag in seconds.
+    """
+    return _loop_lag
+
+def start(port: int = METRICS_PORT) -> None:
+    """
+    Starts the Prometheus HTTP endpoint and the event loop lag monitor. Does nothing if already started.
+
+    Args:
+        port (int, optional): The port of the endpoint, which must differ between processes on a host. Defaults to METRICS_PORT.
+    """
+    global _started
+    if _started:
+        return
+
+    start_http_server(port, addr=METRICS_HOST)
+    asyncio.get_running_loop().create_task(_watch_loop_lag())
+    _started = True
+
+def _percentile(buckets: list[tuple[float, float]], count: float, fraction: float) -> float:
+    """
+    Estimates a percentile from cumulative histogram buckets.
+
+    Args:
+        buckets (list[tuple[float, float]]): The upper bounds and cumulative counts of the buckets, in order.
+        count (float): The total number of observations.
+        fraction (float): The percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float: The upper bound of the bucket the percentile falls in.
+    """
+    for bound, cumulative in buckets:
+        if cumulative >= count * fraction:
+            return bound
+
+    return float("inf")
+
+def summary() -> list[tuple[str, int, float, float]]:
+    """
+    Summarizes the recorded stage latencies.
+
+    Returns:
+        list[tuple[str, int, float, float]]: The name, call count, mean and estimated 95th percentile 
+            in seconds of every stage, slowest total first.
+    """
+    stages = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            stage = stages.setdefault(sample.labels["stage"], {"buckets": [], "count": 0.0, "sum": 0.0})
+            if sample.name.endswith("_bucket"):
+                stage["buckets"].append((float(sample.labels["le"]), sample.value))
+            elif sample.name.endswith("_count"):
+                stage["count"] = sample.value
+            elif sample.name.endswith("_sum"):
+                stage["sum"] = sample.value
+
+    rows = [
+        (name, int(stage["count"]), stage["sum"] / stage["count"], _percentile(stage["buckets"], stage["count"], 0.95))
+        for name, stage in stages.items() if stage["count"]
+    ]
+
+    return sorted(rows, key=lambda row: row[1] * row[2], reverse=True)
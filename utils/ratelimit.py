@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    A bucket that refills continuously up to its capacity.
+
+    Attributes:
+        capacity (float): The maximum number of tokens in the bucket.
+        rate (float): The number of tokens added per second.
+        tokens (float): The number of tokens currently in the bucket. Can be negative after a correction.
+    """
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        """
+        Adds the tokens earned since the last refill.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """
+        Calculates how long to wait until the given amount of tokens is available.
+
+        Args:
+            amount (float): The number of tokens needed. Amounts above the capacity are treated as the full capacity.
+
+        Returns:
+            float: The number of seconds to wait, 0 if the tokens are available now.
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float) -> None:
+        """
+        Removes tokens from the bucket. Negative amounts return tokens.
+
+        Args:
+            amount (float): The number of tokens to remove.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class Limiter:
+    """
+    Paces requests to stay within a requests-per-minute and tokens-per-minute quota.
+
+    Attributes:
+        requests (TokenBucket): The bucket for requests per minute.
+        tokens (TokenBucket): The bucket for tokens per minute.
+        throttled (int): The number of requests rejected by the remote rate limit.
+        retries (int): The number of requests that were retried.
+        failures (int): The number of requests that failed after all retries.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute, 60)
+        self.tokens = TokenBucket(tokens_per_minute, 60)
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """
+        Waits until a request of the estimated size fits in the quota and reserves it.
+        Waiting requests are served in the order they arrived.
+
+        Args:
+            estimated_tokens (int): The number of tokens the request is expected to use.
+        """
+        async with self._lock:
+            while True:
+                wait = max(
+                    self._blocked_until - time.monotonic(),
+                    self.requests.delay(1),
+                    self.tokens.delay(estimated_tokens)
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, used_tokens: int) -> None:
+        """
+        Corrects the token bucket once the real usage of a request is known.
+
+        Args:
+            estimated_tokens (int): The number of tokens reserved for the request.
+            used_tokens (int): The number of tokens the request actually used.
+        """
+        self.tokens.consume(used_tokens - estimated_tokens)
+
+    def block(self, seconds: float) -> None:
+        """
+        Holds back all requests for the given time, e.g. after the remote rate limit was hit.
+
+        Args:
+            seconds (float): The number of seconds to hold requests back.
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the current state of the limiter for monitoring.
+
+        Returns:
+            dict[str, float]: The available quota and request outcome counters.
+        """
+        self.requests.delay(0)
+        self.tokens.delay(0)
+
+        return {
+            "available_requests": self.requests.tokens,
+            "available_tokens": self.tokens.tokens,
+            "blocked_seconds": max(0.0, self._blocked_until - time.monotonic()),
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "failures": self.failures
+        }
@@ -0,0 +1,141 @@
+import importlib
+import os
+import time
+
+import discord
+
+from exceptions import UserInputError
+from utils import system
+
+
+# Reloaded in dependency order, so modules importing names from another module get the new version
+_MODULES = [
+    "config",
+    "utils.system",
+    "utils.ratelimit",
+    "utils.messages",
+    "utils.layout",
+    "utils.database",
+    "utils.image",
+    "utils.gemini",
+    "utils.cache",
+    "utils.render_cache",
+    "utils.members",
+    "utils.scheduler",
+    "utils.analyzer",
+    "utils.jobs"
+]
+
+# Module state kept across reloads: connections, background tasks, queued analyses, caches and running traces.
+# utils.metrics is never reloaded because its collectors cannot be registered twice. Lua scripts are not kept,
+# they are registered again from the kept Redis client so edits to them are applied.
+_KEPT_STATE = {
+    "utils.system": ["_current_span", "_root_span"],
+    "utils.database": ["r", "_connecting"],
+    "utils.cache": ["_local"],
+    "utils.render_cache": ["_entries", "_version", "_listener"],
+    "utils.image": ["session"],
+    "utils.gemini": ["client", "_connecting", "limiter", "_prompt_cache", "_prompt_cache_task", "_prompt_cache_lost", "_prompt_cache_stats"],
+    "utils.scheduler": ["_queues", "_running", "_running_per_user"]
+}
+
+_started = time.time()
+_loaded_at: dict[str, float] = {}
+
+def _changed(path: str) -> bool:
+    """
+    Checks whether a source file was modified since it was last loaded.
+
+    Args:
+        path (str): The path of the source file.
+
+    Returns:
+        bool: True if the file was modified, False otherwise.
+    """
+    return os.path.getmtime(path) > _loaded_at.get(path, _started)
+
+def _check_syntax(path: str) -> None:
+    """
+    Compiles a source file without running it.
+
+    Args:
+        path (str): The path of the source file.
+
+    Raises:
+        UserInputError: If the file has a syntax error.
+    """
+    with open(path, encoding="utf-8") as file:
+        source = file.read()
+
+    try:
+        compile(source, path, "exec")
+    except SyntaxError as error:
+        raise UserInputError(f"Syntax error in {os.path.relpath(path)}, line {error.lineno}: {error.msg}")
+
+def reload_modules() -> list[str]:
+    """
+    Reloads the config and utils modules if any of them changed, keeping their state, and traces them again.
+    All of them are reloaded so that names imported from a changed module are updated everywhere.
+
+    Returns:
+        list[str]: The names of the reloaded modules, empty if none changed.
+
+    Raises:
+        UserInputError: If a module has a syntax error, in which case no module is reloaded.
+    """
+    modules = [importlib.import_module(name) for name in _MODULES]
+    if not any(_changed(module.__file__) for module in modules):
+        return []
+
+    for module in modules:
+        _check_syntax(module.__file__)
+
+    for module in modules:
+        kept = {name: getattr(module, name) for name in _KEPT_STATE.get(module.__name__, [])}
+        try:
+            importlib.reload(module)
+        finally:
+            for name, value in kept.items():
+                setattr(module, name, value)
+        _loaded_at[module.__file__] = time.time()
+
+        if module.__name__ == "utils.database" and module.r is not None:
+            module._update_score_script = module.r.register_script(module._UPDATE_SCORE_LUA)
+
+    system.trace_all_utils()
+
+    return [module.__name__ for module in modules]
+
+async def reload_cogs(bot: discord.Bot, reload_all: bool = False) -> list[str]:
+    """
+    Reloads the cogs that changed, loads new cogs and updates the registered commands if any cog was loaded.
+
+    Args:
+        bot (discord.Bot): The bot the cogs are loaded into.
+        reload_all (bool, optional): Whether to reload unchanged cogs as well, e.g. after the utils were reloaded. Defaults to False.
+
+    Returns:
+        list[str]: The names of the reloaded and newly loaded cogs.
+
+    Raises:
+        UserInputError: If a changed cog has a syntax error, in which case no cog is reloaded.
+    """
+    changed = []
+    for file in sorted(os.listdir("./cogs")):
+        name, ext = os.path.splitext(file)
+        path = os.path.abspath(os.path.join("cogs", file))
+        if ext == ".py" and (reload_all or f"cogs.{name}" not in bot.extensions or _changed(path)):
+            _check_syntax(path)
+            changed.append((f"cogs.{name}", path))
+
+    for extension, path in changed:
+        if extension in bot.extensions:
+            bot.reload_extension(extension)
+        else:
+            bot.load_extension(extension)
+        _loaded_at[path] = time.time()
+
+    if changed:
+        await bot.sync_commands()
+
+    return [extension for extension, _ in changed]
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+from redis.exceptions import RedisError
+
+from config import RENDER_CACHE_SIZE, RENDER_CACHE_TTL, RENDER_CACHE_RESYNC
+from utils import database, metrics, system
+
+
+T = TypeVar("T")
+
+_entries: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+_version: int | None = None # The score version the entries were rendered at, None while it is unknown
+_listener: asyncio.Task | None = None
+
+def _set_version(version: int | None) -> None:
+    """
+    Records the current score version, dropping every entry if it changed.
+
+    Args:
+        version (int | None): The score version, None if it is unknown.
+    """
+    global _version
+    if version != _version:
+        _entries.clear()
+    _version = version
+
+async def _follow_version() -> None:
+    """
+    Follows the score version published by every process updating scores. The version is also read every
+    RENDER_CACHE_RESYNC seconds, in case a change was published while the subscription was reconnecting.
+    Nothing is cached while the subscription is down.
+    """
+    while True:
+        try:
+            async with await database.subscribe_score_version() as pubsub:
+                while True:
+                    _set_version(await database.get_score_version())
+                    resync_at = time.monotonic() + RENDER_CACHE_RESYNC
+
+                    while (timeout := resync_at - time.monotonic()) > 0:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+                        if message is not None:
+                            _set_version(int(message["data"]))
+        except RedisError as error:
+            _set_version(None)
+            system.log(1, f"Lost the score version subscription: {error}")
+            await asyncio.sleep(1)
+
+def start() -> None:
+    """
+    Starts following the score version, without which nothing is cached. Does nothing if already started.
+    """
+    global _listener
+    if _listener is None:
+        _listener = asyncio.get_running_loop().create_task(_follow_version())
+
+def stop() -> None:
+    """
+    Stops following the score version and drops every entry.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        _listener = None
+    _set_version(None)
+
+async def get(key: Hashable, render: Callable[[], Awaitable[T]]) -> T:
+    """
+    Returns a rendered response, rendering it only if no score changed since it was last rendered.
+
+    Args:
+        key (Hashable): Identifies the response, including everything it depends on besides the scores.
+        render (Callable[[], Awaitable[T]]): Reads the scores and renders the response.
+
+    Returns:
+        T: The rendered response.
+    """
+    version = _version
+    entry = _entries.get(key)
+
+    if version is not None and entry is not None and entry[0] > time.monotonic():
+        _entries.move_to_end(key)
+        metrics.RENDER_CACHE.labels("hit").inc()
+        return entry[1]
+
+    metrics.RENDER_CACHE.labels("miss").inc()
+    value = await render()
+
+    # A score that changed while rendering may not be part of the response
+    if version is not None and version == _version:
+        _entries[key] = (time.monotonic() + RENDER_CACHE_TTL, value)
+        _entries.move_to_end(key)
+        while len(_entries) > RENDER_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+    return value
@@ -0,0 +1,181 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, TypeVar
+
+from config import MAX_CONCURRENT_ANALYSES, MAX_ANALYSES_PER_USER, MAX_QUEUED_ANALYSES
+from exceptions import UserInputError
+from utils import metrics
+
+
+T = TypeVar("T")
+
+class _Ticket:
+    """
+    A place in the queue for a single job.
+
+    Attributes:
+        per_user (bool): Whether the job takes one of its user's MAX_ANALYSES_PER_USER slots.
+        concurrent (bool): Whether the job takes one of the MAX_CONCURRENT_ANALYSES slots.
+        started (bool): Whether the job has been allowed to run.
+        moved (asyncio.Event): Set whenever the queue changes and the job's position may have changed.
+    """
+    def __init__(self, per_user: bool, concurrent: bool):
+        self.per_user = per_user
+        self.concurrent = concurrent
+        self.started = False
+        self.moved = asyncio.Event()
+
+_queues: OrderedDict[int, deque[_Ticket]] = OrderedDict()
+_running = 0
+_running_per_user: dict[int, int] = {}
+
+def _can_start(user_id: int, ticket: _Ticket) -> bool:
+    """
+    Checks whether the global and per-user limits allow a queued job to start.
+
+    Args:
+        user_id (int): The ID of the user the job belongs to.
+        ticket (_Ticket): The ticket of the queued job.
+
+    Returns:
+        bool: True if the job can start, False otherwise.
+    """
+    if ticket.concurrent and _running >= MAX_CONCURRENT_ANALYSES:
+        return False
+
+    return not ticket.per_user or _running_per_user.get(user_id, 0) < MAX_ANALYSES_PER_USER
+
+def _dispatch() -> None:
+    """
+    Starts queued jobs, one per user in turn, until the global or per-user limits are reached. A user's 
+    oldest job that is allowed to start goes first, so images of a running batch are not held up by
+    the user's next analysis waiting for the batch to finish.
+    """
+    global _running
+
+    started = True
+    while started:
+        started = False
+        for user_id in list(_queues):
+            ticket = next((ticket for ticket in _queues[user_id] if _can_start(user_id, ticket)), None)
+            if ticket is None:
+                continue
+
+            _queues[user_id].remove(ticket)
+            if _queues[user_id]:
+                _queues.move_to_end(user_id)
+            else:
+                del _queues[user_id]
+
+            if ticket.concurrent:
+                _running += 1
+            if ticket.per_user:
+                _running_per_user[user_id] = _running_per_user.get(user_id, 0) + 1
+            ticket.started = True
+            ticket.moved.set()
+            started = True
+
+    for queue in _queues.values():
+        for ticket in queue:
+            ticket.moved.set()
+
+def _position(ticket: _Ticket) -> int:
+    """
+    Calculates the position of a queued job, following the order in which users are served.
+
+    Args:
+        ticket (_Ticket): The ticket of the queued job.
+
+    Returns:
+        int: The one-based position of the job in the queue.
+    """
+    queues = list(_queues.values())
+    position = 0
+
+    for depth in range(max(len(queue) for queue in queues)):
+        for queue in queues:
+            if depth < len(queue):
+                position += 1
+                if queue[depth] is ticket:
+                    return position
+
+    return position
+
+def queued() -> int:
+    """
+    Returns the number of jobs waiting to run.
+
+    Returns:
+        int: The number of queued jobs.
+    """
+    return sum(len(queue) for queue in _queues.values())
+
+def running() -> int:
+    """
+    Returns the number of jobs currently running.
+
+    Returns:
+        int: The number of running jobs.
+    """
+    return _running
+
+async def run(user_id: int, job: Callable[[], Awaitable[T]], on_position: Callable[[int], Awaitable[None]] | None = None,
+              per_user: bool = True, concurrent: bool = True) -> T:
+    """
+    Runs a job once the concurrency limits allow it, serving queued users round-robin.
+
+    Args:
+        user_id (int): The ID of the user the job belongs to.
+        job (Callable[[], Awaitable[T]]): A function that starts the job.
+        on_position (Callable[[int], Awaitable[None]], optional): Called with the job's queue position whenever it changes, 
+            and with 0 once a queued job starts. Defaults to None.
+        per_user (bool, optional): Whether the job counts against MAX_ANALYSES_PER_USER, e.g. not for the images of
+            a batch that already holds the user's slot. Defaults to True.
+        concurrent (bool, optional): Whether the job counts against MAX_CONCURRENT_ANALYSES, e.g. not for a batch 
+            whose images each count on their own. Defaults to True.
+
+    Returns:
+        T: The result of the job.
+
+    Raises:
+        UserInputError: If the queue is full.
+    """
+    global _running
+
+    if queued() >= MAX_QUEUED_ANALYSES:
+        raise UserInputError("Too many images are waiting to be analyzed, please try again later")
+
+    ticket = _Ticket(per_user, concurrent)
+    _queues.setdefault(user_id, deque()).append(ticket)
+    _dispatch()
+
+    try:
+        last_position = None
+        while not ticket.started:
+            ticket.moved.clear()
+            position = _position(ticket)
+            if on_position and position != last_position:
+                await on_position(position)
+                last_position = position
+            await ticket.moved.wait()
+
+        if on_position and last_position is not None:
+            await on_position(0)
+
+        return await job()
+    finally:
+        if ticket.started:
+            if ticket.concurrent:
+                _running -= 1
+            if ticket.per_user:
+                _running_per_user[user_id] -= 1
+                if _running_per_user[user_id] == 0:
+                    del _running_per_user[user_id]
+        else:
+            _queues[user_id].remove(ticket)
+            if not _queues[user_id]:
+                del _queues[user_id]
+        _dispatch()
+
+metrics.ANALYSES_IN_FLIGHT.set_function(running)
+metrics.ANALYSES_QUEUED.set_function(queued)
@@ -1,73 +1,174 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
 import inspect
+import json
 import logging
+import random
+import time as _time
 from datetime import datetime
-import asyncio
 
-from config import ICON_SET
+from config import ICON_SET, TRACE_SAMPLE_RATE, TRACE_VERBOSITY
 import utils
 
-_dynamic_indent = 0
 logging.basicConfig(format='%(asctime)s | %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
 logging.getLogger('discord').setLevel(logging.ERROR)
 logging.getLogger('google_genai').setLevel(logging.ERROR)
 logging.getLogger('httpx').setLevel(logging.ERROR)
 
-def reset_dynamic_indent():
+class _Span:
     """
-    Resets the dynamic indentation level to its initial value.
-    """
-    global _dynamic_indent
-    _dynamic_indent = 0
+    A timed call in a command's call tree.
 
-def _pre_log(name: str) -> None:
+    Attributes:
+        name (str): The name of the traced function or command.
+        start (int): The monotonic start time in nanoseconds.
+        end (int | None): The monotonic end time in nanoseconds, None while the call is running.
+        error (str | None): The name of the exception that ended the call, if any.
+        children (list[_Span]): The traced calls made during this call.
     """
-    Logs the function name and its arguments before the function is called.
+    __slots__ = ("name", "start", "end", "error", "children")
 
-    Parameters:
-        name (str): The name of the function.
-        args (tuple): The arguments passed to the function.
-        kwargs (dict): The keyword arguments passed to the function.
-    """
-    global _dynamic_indent 
-        
-    _dynamic_indent += 1
+    def __init__(self, name: str):
+        self.name = name
+        self.start = _time.perf_counter_ns()
+        self.end = None
+        self.error = None
+        self.children = []
 
-    log(2, f"{name}, was called", _dynamic_indent)
+    def duration_ms(self) -> float:
+        """
+        Returns the duration of the call, up to now if it is still running.
 
-def _post_log(name: str) -> None:
-    """
-    Logs the function name and its results after the function is called.
+        Returns:
+            float: The duration in milliseconds.
+        """
+        end = self.end if self.end is not None else _time.perf_counter_ns()
+        return round((end - self.start) / 1_000_000, 3)
 
-    Parameters:
-        name (str): The name of the function.
-        results (any): The results returned by the function.
-    """
-    global _dynamic_indent 
+    def tree(self) -> dict:
+        """
+        Converts the span and its children into a nested dictionary.
 
-    log(0, f"{name}, returned", _dynamic_indent)
+        Returns:
+            dict: The call tree rooted at this span.
+        """
+        node = {"name": self.name, "duration_ms": self.duration_ms()}
+        if self.error:
+            node["error"] = self.error
+        if self.children:
+            node["children"] = [child.tree() for child in self.children]
+        return node
 
-    _dynamic_indent -= 1
+    def totals(self, totals: dict | None = None) -> dict:
+        """
+        Sums the call counts and durations of all descendants by function name.
+
+        Args:
+            totals (dict, optional): The totals to add to. Defaults to a new dictionary.
+
+        Returns:
+            dict: The number of calls and total milliseconds per function name.
+        """
+        totals = {} if totals is None else totals
+        for child in self.children:
+            entry = totals.setdefault(child.name, {"calls": 0, "total_ms": 0.0})
+            entry["calls"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + child.duration_ms(), 3)
+            child.totals(totals)
+        return totals
+
+# The span of the call currently running in this task, None when the task is not being traced.
+# Tasks started from a traced call inherit it, so concurrent work is attached to the right command.
+_current_span: ContextVar[_Span | None] = ContextVar("current_span", default=None)
+_root_span: ContextVar[_Span | None] = ContextVar("root_span", default=None)
+
+def _sync_trace_wrapper(func):
+    name = f"{func.__module__.removeprefix('utils.')}.{func.__name__}"
 
-def _sync_log_wrapper(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        _pre_log(func.__name__)
-        result = func(*args, **kwargs)
-        _post_log(func.__name__)
-        return result
+        parent = _current_span.get()
+        if parent is None:
+            return func(*args, **kwargs)
+
+        span = _Span(name)
+        parent.children.append(span)
+        token = _current_span.set(span)
+        try:
+            return func(*args, **kwargs)
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end = _time.perf_counter_ns()
+            _current_span.reset(token)
+    wrapper._traced = True
     return wrapper
 
-def _async_log_wrapper(func):
+def _async_trace_wrapper(func):
+    name = f"{func.__module__.removeprefix('utils.')}.{func.__name__}"
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        await asyncio.sleep(0) # Yield control to the event loop
-        _pre_log(func.__name__)
-        result = await func(*args, **kwargs)
-        _post_log(func.__name__)
-        return result
+        parent = _current_span.get()
+        if parent is None:
+            return await func(*args, **kwargs)
+
+        span = _Span(name)
+        parent.children.append(span)
+        token = _current_span.set(span)
+        try:
+            return await func(*args, **kwargs)
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end = _time.perf_counter_ns()
+            _current_span.reset(token)
+    wrapper._traced = True
     return wrapper
 
+def start_trace(name: str) -> None:
+    """
+    Starts tracing a command in the current task, if tracing is enabled and the command is sampled.
+
+    Parameters:
+        name (str): The name of the command.
+    """
+    if TRACE_VERBOSITY == 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return
+
+    root = _Span(name)
+    _root_span.set(root)
+    _current_span.set(root)
+
+def finish_trace(user: str) -> None:
+    """
+    Finishes the trace of the command running in the current task and logs it as a single record.
+
+    Parameters:
+        user (str): The user that invoked the command.
+    """
+    root = _root_span.get()
+    if root is None:
+        return
+
+    _root_span.set(None)
+    _current_span.set(None)
+    root.end = _time.perf_counter_ns()
+
+    record = {
+        "command": root.name,
+        "user": user,
+        "duration_ms": root.duration_ms(),
+        "functions": root.totals()
+    }
+    if TRACE_VERBOSITY >= 2:
+        record["calls"] = root.tree().get("children", [])
+
+    log(0, f"Trace {json.dumps(record)}")
+
 def log(code: int, message: str, indent: int = 0) -> None:
     """
     Logs a message with a corresponding icon and timestamp.
@@ -98,23 +199,69 @@ def time() -> str:
     """
     return datetime.now().strftime("%H:%M:%S")
 
-def log_all_utils() -> None:
+_startup_phases: dict[str, float] = {}
+
+def record_startup_phase(name: str, seconds: float) -> None:
+    """
+    Records the duration of a phase of the startup for the startup report.
+
+    Parameters:
+        name (str): The name of the phase.
+        seconds (float): The duration of the phase in seconds.
+    """
+    _startup_phases[name] = seconds
+
+@contextmanager
+def startup_phase(name: str):
+    """
+    Measures a phase of the startup for the startup report. Phases can run concurrently.
+
+    Parameters:
+        name (str): The name of the phase.
+    """
+    start = _time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(name, _time.perf_counter() - start)
+
+def log_startup(total: float) -> None:
     """
-    Logs all functions in the utils module.
+    Logs the duration of every recorded startup phase and the total startup time, once.
+
+    Parameters:
+        total (float): Seconds from the start of the process until the bot was ready to serve.
     """
+    if not _startup_phases:
+        return
+
+    phases = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in _startup_phases.items())
+    log(0, f"Ready to serve in {total * 1000:.0f} ms ({phases})")
+    _startup_phases.clear()
+
+def trace_all_utils() -> None:
+    """
+    Traces all functions in the utils modules, skipping functions that are already traced. 
+    Does nothing if tracing is disabled.
+    """
+    if TRACE_VERBOSITY == 0 or TRACE_SAMPLE_RATE == 0:
+        return
+
     modules = [
         utils.analyzer,
+        utils.cache,
         utils.database,
         utils.gemini,
         utils.image,
-        utils.layout
+        utils.layout,
+        utils.members
     ]
 
     for module in modules:
         for attr_name in dir(module):
             attr = getattr(module, attr_name)
-            if inspect.isfunction(attr):
+            if inspect.isfunction(attr) and attr.__module__ == module.__name__ and not getattr(attr, "_traced", False):
                 if inspect.iscoroutinefunction(attr):
-                    setattr(module, attr_name, _async_log_wrapper(attr))
+                    setattr(module, attr_name, _async_trace_wrapper(attr))
                 else:
-                    setattr(module, attr_name, _sync_log_wrapper(attr))
+                    setattr(module, attr_name, _sync_trace_wrapper(attr))
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import socket
+from dotenv import load_dotenv
+
+from config import WORKER_METRICS_PORT
+from utils import system, image, metrics, database, gemini, jobs
+
+
+load_dotenv(override=True)
+
+system.log(2, "Starting analysis worker")
+
+# WORKER_ID tells workers on the same host apart, and WORKER_COUNT splits the Gemini quota between the workers
+if os.getenv("WORKER_COUNT"):
+    gemini.share_quota(1 / int(os.getenv("WORKER_COUNT")))
+
+async def main():
+    image.create_session()
+    await asyncio.gather(database.connect(), gemini.connect())
+    await database.create_job_group()
+    metrics.start(WORKER_METRICS_PORT + int(os.getenv("WORKER_ID", "0")))
+    gemini.start()
+
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    system.log(0, f"Worker {consumer} is running")
+
+    try:
+        await jobs.consume(consumer)
+    finally:
+        await gemini.close()
+        await image.close_session()
+        await database.close()
+
+asyncio.run(main())